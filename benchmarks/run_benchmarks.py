@@ -0,0 +1,279 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+
+# Benchmarks for colorimeter_functions and the genalyzer signal pipeline
+# No hardware is needed. Genalyzer stages run on genalyzer_numpy, and on genalyzer_advanced when it is installed.
+#
+#   python benchmarks/run_benchmarks.py --output results.json
+#   python benchmarks/run_benchmarks.py --save-baseline              # store benchmarks/baseline.json
+#   python benchmarks/run_benchmarks.py --baseline benchmarks/baseline.json
+#
+# Each timed sample calls a benchmark in a loop until the sample lasts at least --min-time seconds, and
+# the result holds the best and median time per call over --repeat samples, plus the peak traced memory
+# of one extra call. With a baseline, any benchmark whose median is slower than --threshold, and slower
+# by more than --noise-floor seconds per call, or whose memory grew more than --threshold, is reported
+# and the exit code is 1.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'colorimeter'))
+sys.path.insert(0, os.path.join(ROOT, 'genalyzer'))
+
+import colorimeter_functions  # noqa: E402
+import colorimeter_lockin  # noqa: E402
+import genalyzer_functions  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+
+def colorimeter_benchmarks(quick):
+    # Each benchmark is (name, params, fn), fn being called with no arguments
+    cf = colorimeter_functions
+    rates = cf.pg_available_sample_rates[1:4] if quick else cf.pg_available_sample_rates[1:6]
+    frame_sizes = [1024, 4096] if quick else [1024, 4096, 16384, 65536]
+
+    for rate in rates:
+        params = {'sample_rate': rate, 'freq': cf.red_freq}
+        # Planning results are memoized, clear them so every run pays the full cost
+        yield ('get_best_ratio', params,
+               lambda rate=rate: (cf.plan_period.cache_clear(), cf.get_best_ratio(rate / cf.red_freq)))
+        yield ('square_buffer_generator', params,
+               lambda rate=rate: cf.square_buffer_generator(cf.red_freq, 0, rate))
+        sig = cf.square_buffer_generator(cf.red_freq, 0, rate)
+        yield ('square_wave_digital', params,
+               lambda sig=sig: cf.square_wave_digital(sig, cf.pg_channels[13]))
+        # Some rates cannot hold every LED tone in one buffer, create_digital_buffer refuses them
+        if cf.plan_buffer(rate, cf.led_freqs) is not None:
+            yield ('create_digital_buffer', {'sample_rate': rate},
+                   lambda rate=rate: cf.create_digital_buffer(rate))
+        else:
+            print("create_digital_buffer skipped at {} Sa/s: no buffer fits {}".format(rate, cf.led_freqs),
+                  file=sys.stderr)
+
+    rng = np.random.default_rng(0)
+    for samples in frame_sizes:
+        frame = rng.normal(size=samples)
+        yield ('compute_fft', {'samples': samples}, lambda frame=frame: cf.compute_fft(frame))
+
+        acq_plan = cf.plan_acquisition(10000, cf.led_freqs, samples)
+        ref_fft = cf.compute_fft(rng.normal(size=acq_plan.samples))
+        sample_fft = cf.compute_fft(rng.normal(size=acq_plan.samples))
+        yield ('light_transmittance', {'samples': acq_plan.samples},
+               lambda bins=acq_plan.bins, ref_fft=ref_fft, sample_fft=sample_fft:
+               cf.light_transmittance(*bins, sample_fft, ref_fft))
+        frame = rng.normal(size=(8, acq_plan.samples))
+        yield ('transmittance_matrix', {'samples': acq_plan.samples, 'channels': 8},
+               lambda frame=frame, table=cf.bin_table(acq_plan.bins):
+               cf.transmittance_matrix(frame, table, window='rectangular'))
+
+    for chunk in [100, 1000] if quick else [100, 1000, 10000]:
+        chunk_data = rng.normal(size=(2, chunk))
+        demodulator = colorimeter_lockin.LockInDemodulator(10000, cf.led_freqs, output_rate=100)
+        yield 'lockin_process', {'chunk': chunk}, lambda d=demodulator, data=chunk_data: d.process(data)
+
+
+def multitone_benchmarks(quick):
+    # Waveform synthesis of genalyze_signal.py, pure NumPy so it always runs
+    fs = 1000
+    nfft = 1024 * 256
+    navgs = [2] if quick else [2, 16]
+    fund_freq = 1.0
+    tones = genalyzer_functions.tone_table(
+        [fund_freq * h for h in (1, 2, 3, 4)] + [1.5, 2.5, 3.5, 4.5],
+        genalyzer_functions.dbfs_to_ampl([-3.0, -23.0, -200.0, -200.0, -200.0, -23.0, -200.0, -200.0], 2.0))
+    for navg in navgs:
+        for dtype in (np.float64, np.float32):
+            params = {'nfft': nfft, 'navg': navg, 'dtype': np.dtype(dtype).name}
+            yield ('multitone', params,
+                   lambda npts=navg * nfft, dtype=dtype: genalyzer_functions.multitone(npts, fs, tones, dtype=dtype))
+
+
+def genalyzer_benchmarks(quick):
+    # Same stages, with the same settings, as genalyzer/genalyze_signal.py, for every available backend
+    backends = ['numpy']
+    try:
+        genalyzer_functions.import_genalyzer('genalyzer')
+        backends.insert(0, 'genalyzer')
+    except ImportError:
+        print("genalyzer_advanced is not installed, running the numpy backend only", file=sys.stderr)
+    for backend in backends:
+        yield from _genalyzer_stages(genalyzer_functions.import_genalyzer(backend), backend, quick)
+
+
+def _genalyzer_stages(gn, backend, quick):
+    fs = 1000
+    fsr = 2.0
+    qres = 16
+    qnoise = 10 ** (-140.0 / 20)
+    code_fmt = gn.CodeFormat.TWOS_COMPLEMENT
+    window = gn.Window.NO_WINDOW
+    harm_dbfs = [-3.0, -23.0, -200.0, -200.0]
+    noise_freqs = [1.5, 2.5, 3.5, 4.5]
+    noise_dbfs = [-200.0, -23.0, -200.0, -200.0]
+
+    nffts = [1024 * 16] if quick else [1024 * 16, 1024 * 256]
+    navgs = [2] if quick else [2, 16]
+    for nfft in nffts:
+        for navg in navgs:
+            npts = navg * nfft
+            params = {'nfft': nfft, 'navg': navg, 'backend': backend}
+            fund_freq = gn.coherent(nfft, fs, 1.0)
+            tones = [(fund_freq * (h + 1), (fsr / 2) * 10 ** (dbfs / 20)) for h, dbfs in enumerate(harm_dbfs)]
+            tones += [(gn.coherent(nfft, fs, freq), (fsr / 2) * 10 ** (dbfs / 20))
+                      for freq, dbfs in zip(noise_freqs, noise_dbfs)]
+
+            def synthesize(npts=npts, tones=tones):
+                awf = np.zeros(npts)
+                for freq, ampl in tones:
+                    awf += gn.cos(npts, fs, ampl, freq, 0.0, 0.0, 0.0)
+                return awf
+
+            awf = synthesize()
+            qwf = gn.quantize(awf, fsr, qres, qnoise, code_fmt)
+            fft_cplx = gn.rfft(np.array(qwf), qres, navg, nfft, window, code_fmt, gn.RfftScale.DBFS_SIN)
+
+            key = genalyzer_functions.configure_fa(gn, 'bench_{}_{}_{}'.format(backend, nfft, navg), fund_freq, fs,
+                                                   ssb_fund=0, ssb_rest=0)
+
+            yield 'genalyzer_synthesis', params, synthesize
+            yield ('genalyzer_quantize', params,
+                   lambda awf=awf: gn.quantize(awf, fsr, qres, qnoise, code_fmt))
+            yield ('genalyzer_rfft', params,
+                   lambda qwf=qwf, navg=navg, nfft=nfft:
+                   gn.rfft(np.array(qwf), qres, navg, nfft, window, code_fmt, gn.RfftScale.DBFS_SIN))
+            yield ('genalyzer_fft_analysis', params,
+                   lambda key=key, fft_cplx=fft_cplx, nfft=nfft: gn.fft_analysis(key, fft_cplx, nfft))
+
+
+def calibrate_loops(timer, min_time):
+    # Number of calls per sample so one sample lasts at least min_time, the calls also warm up caches
+    loops = 1
+    while True:
+        elapsed = timer.timeit(loops)
+        if elapsed >= min_time:
+            return loops
+        # Aim a little past min_time, at most 10x more calls per step
+        loops = int(loops * min(10.0, max(2.0, 1.2 * min_time / max(elapsed, 1e-9))))
+
+
+def measure(benchmarks, repeat, min_time=0.05, on_result=None):
+    # Times every (name, params, fn) of benchmarks, returns one result dict each
+    # The samples are taken in rounds over all benchmarks rather than back to back, so a machine
+    # wide slowdown of a few seconds spoils one sample of many benchmarks, not the median of one
+    timers = [timeit.Timer(fn) for name, params, fn in benchmarks]
+    loops = [calibrate_loops(timer, min_time) for timer in timers]
+    times = [[] for timer in timers]
+    for i in range(repeat):
+        for timer, n, samples in zip(timers, loops, times):
+            samples.append(timer.timeit(n) / n)
+
+    results = []
+    for (name, params, fn), n, samples in zip(benchmarks, loops, times):
+        # Memory is measured on a separate call, tracing slows the code down
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        result = {'name': name, 'params': params, 'wall_s_min': min(samples),
+                  'wall_s_median': statistics.median(samples), 'loops': n, 'peak_bytes': peak}
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+    return results
+
+
+def result_key(result):
+    return result['name'] + json.dumps(result['params'], sort_keys=True)
+
+
+def compare(results, baseline, threshold, noise_floor=0.0):
+    # Returns (name, params, metric, ratio) for every regression beyond threshold
+    # Times are per call medians, a slowdown of less than noise_floor seconds is never a regression
+    reference = {result_key(result): result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        old = reference.get(result_key(result))
+        if old is None:
+            continue
+        for metric, floor in (('wall_s_median', noise_floor), ('peak_bytes', 0)):
+            if old[metric] > 0:
+                ratio = result[metric] / old[metric]
+                result[metric + '_ratio'] = ratio
+                if ratio > 1 + threshold and result[metric] - old[metric] > floor:
+                    regressions.append((result['name'], result['params'], metric, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the colorimeter and genalyzer code")
+    parser.add_argument('--output', help="write results as JSON to this file (default: stdout)")
+    parser.add_argument('--baseline', help="compare against this results file")
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help="also store results as the new baseline (default: benchmarks/baseline.json)")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed slowdown or memory growth before reporting a regression (default: 0.25)")
+    parser.add_argument('--repeat', type=int, default=5, help="timed samples per benchmark (default: 5)")
+    parser.add_argument('--min-time', type=float, default=0.05,
+                        help="minimum duration of one sample in seconds, short calls are looped (default: 0.05)")
+    parser.add_argument('--noise-floor', type=float, default=5e-6,
+                        help="slowdowns under this many seconds per call are noise (default: 5e-6)")
+    parser.add_argument('--filter', default='', help="only run benchmarks whose name contains this text")
+    parser.add_argument('--quick', action='store_true', help="smaller sizes, for a fast sanity check")
+    args = parser.parse_args(argv)
+
+    benchmarks = list(colorimeter_benchmarks(args.quick)) + list(multitone_benchmarks(args.quick)) + \
+        list(genalyzer_benchmarks(args.quick))
+    benchmarks = [benchmark for benchmark in benchmarks if args.filter in benchmark[0]]
+
+    def print_result(result):
+        print("{:28s}{:40s}{:12.6f} s{:14d} B".format(result['name'], json.dumps(result['params']),
+                                                       result['wall_s_median'], result['peak_bytes']),
+              file=sys.stderr)
+
+    results = measure(benchmarks, args.repeat, args.min_time, print_result)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.noise_floor)
+        for name, params, metric, ratio in regressions:
+            print("REGRESSION {} {} {}: {:.2f}x baseline".format(name, json.dumps(params), metric, ratio),
+                  file=sys.stderr)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'min_time': args.min_time,
+            'quick': args.quick,
+        },
+        'results': results,
+        'regressions': [{'name': name, 'params': params, 'metric': metric, 'ratio': ratio}
+                        for name, params, metric, ratio in regressions],
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text + '\n')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
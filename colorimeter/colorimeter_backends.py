@@ -0,0 +1,231 @@
+import time
+import numpy as np
+import colorimeter_functions
+
+
+class Backend:
+    # Hardware seen by the colorimeter engine
+    #
+    # set_powersupply()                            power up the photodiode OP Amps
+    # push_pattern(buffer, sample_rate, channels)  drive the LED with a cyclic DIO buffer
+    # acquire(samples)                             one (2, samples) frame: reference, sample photodiode
+    #                                              (more rows for rigs with several sample channels)
+    # close()                                      release the hardware
+    #
+    # uri is where the device was found, device_id names the board that reads the photodiodes
+    # (used to key saved calibrations), sample_rate is the ADC rate in Sa/s, rows is the number
+    # of rows in every acquired frame. contiguous is True only if each acquire() continues exactly
+    # where the previous one stopped; hardware backends start a new capture on every call.
+    # saves_calibration is False for backends whose frames do not come from device_id right now,
+    # calibrations measured on them are used but never stored under that board.
+
+    uri = None
+    sample_rate = None
+    rows = 2
+    contiguous = False
+    saves_calibration = True
+
+    @property
+    def device_id(self):
+        return self.uri
+
+    def set_powersupply(self):
+        raise NotImplementedError
+
+    def push_pattern(self, buffer, sample_rate, channels):
+        raise NotImplementedError
+
+    def acquire(self, samples):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class M2KBackend(Backend):
+    # ADALM2000: analog inputs 1+ and 2+ read the photodiodes, DIO drives the LED,
+    # the power supply feeds the OP Amps
+
+    def __init__(self, uri="ip:192.168.2.1", sample_rate=10000, analog_in=True):
+        import libm2k
+        self.libm2k = libm2k
+        self.uri = uri
+        self.ctx = libm2k.m2kOpen(uri)
+        if self.ctx is None:
+            raise RuntimeError("No M2K found at {}".format(uri))
+        self.digital = self.ctx.getDigital()
+        self.ps = self.ctx.getPowerSupply()
+
+        if analog_in:
+            # Calibrate at the maximum rate, then configure Analog Inputs
+            self.adc = self.ctx.getAnalogIn()
+            self.adc.setSampleRate(100000000)
+            self.ctx.calibrateADC()
+            self.adc.enableChannel(0, True)
+            self.adc.enableChannel(1, True)
+            self.adc.setSampleRate(sample_rate)
+            self.adc.setRange(0, -1, 1)
+            self.adc.setRange(1, -1, 1)
+            self.sample_rate = self.adc.getSampleRate()
+
+    @property
+    def device_id(self):
+        return "m2k:" + self.ctx.getSerialNumber()
+
+    def set_powersupply(self):
+        # Enable and set power supply pins to +5, -5 V to power up OP Amp
+        colorimeter_functions.set_powersupply(self.ps)
+
+    def push_pattern(self, buffer, sample_rate, channels):
+        self.digital.setSampleRateOut(sample_rate)
+        for channel in channels:
+            self.digital.setDirection(channel, self.libm2k.DIO_OUTPUT)
+            self.digital.enableChannel(channel, True)
+        self.digital.setCyclic(True)
+        # libm2k expects a list of ints
+        self.digital.push(np.asarray(buffer).tolist())
+
+    def acquire(self, samples):
+        return np.asarray(self.adc.getSamples(samples))
+
+    def close(self):
+        self.libm2k.contextClose(self.ctx)
+
+
+class AD4630Backend(M2KBackend):
+    # AD4630 reads the photodiodes through pyadi-iio, the M2K still drives the LED and the power supply
+
+    def __init__(self, adc_uri="ip:192.168.10.2", pg_uri="ip:192.168.2.1", device_name="ad4630-16",
+                 sample_rate=10000, channels=(0, 2)):
+        super().__init__(pg_uri, analog_in=False)
+        import adi
+        self.uri = adc_uri
+        self.channels = list(channels)
+        self.adc = adi.ad4630(uri=adc_uri, device_name=device_name)
+        self.adc.sample_rate = sample_rate
+        self.adc.rx_enabled_channels = [0, 1]
+        self.sample_rate = self.adc.sample_rate
+
+    @property
+    def device_id(self):
+        return "ad4630:" + self.uri
+
+    @property
+    def rows(self):
+        return len(self.channels)
+
+    def acquire(self, samples):
+        if self.adc.rx_buffer_size != samples:
+            self.adc.rx_destroy_buffer()
+            self.adc.rx_buffer_size = samples
+        data = self.adc.rx()
+        return np.real([data[channel] for channel in self.channels])
+
+
+class ReplayBackend(Backend):
+    # Feeds the frames of a capture file (see colorimeter_capture) back, in order, without copying
+    # Frames come back as fast as they are asked for unless realtime is set,
+    # loop=True starts over at the end instead of raising EOFError
+    # device_id is the recorded board, so its saved calibration can be loaded, but never overwritten
+
+    saves_calibration = False
+
+    def __init__(self, path, loop=False, realtime=False):
+        from colorimeter_capture import CaptureReader
+        self.reader = CaptureReader(path)
+        self.uri = self.reader.metadata.get('uri', 'replay:' + path)
+        self.recorded_device_id = self.reader.metadata.get('device_id', self.uri)
+        self.sample_rate = self.reader.sample_rate
+        self.rows = self.reader.metadata['channels']
+        # Looping jumps from the last frame back to the first
+        self.contiguous = self.reader.metadata.get('contiguous', False) and not loop
+        self.loop = loop
+        self.realtime = realtime
+        self.position = 0
+
+    @property
+    def device_id(self):
+        return self.recorded_device_id
+
+    def set_powersupply(self):
+        pass
+
+    def push_pattern(self, buffer, sample_rate, channels):
+        pass
+
+    def acquire(self, samples):
+        if samples != self.reader.metadata['samples']:
+            raise ValueError("Capture holds frames of {} samples, not {}".format(
+                self.reader.metadata['samples'], samples))
+        if self.position == len(self.reader):
+            if not self.loop or not len(self.reader):
+                raise EOFError("End of capture")
+            self.position = 0
+        frame = self.reader.frames[self.position]
+        self.position += 1
+        if self.realtime:
+            time.sleep(samples / self.sample_rate)
+        return frame
+
+
+class SimulatedBackend(Backend):
+    # No hardware: photodiode signals are synthesized from the pushed DIO pattern
+    #
+    # Each LED colour lights both photodiodes with amplitude volts while its DIO bit is high.
+    # The sample photodiode sees it through attenuation (one factor per pushed channel, in order),
+    # then both get Gaussian noise. Signals stay flat until set_powersupply() is called,
+    # like the real OP Amps. With realtime=False frames come back as fast as they are computed.
+
+    uri = "sim:"
+    # The simulated pattern keeps running from one acquire() to the next
+    contiguous = True
+
+    def __init__(self, sample_rate=10000, attenuation=(0.8, 0.5, 0.3), noise=0.001, amplitude=0.1,
+                 realtime=True, seed=None):
+        self.sample_rate = sample_rate
+        self.attenuation = np.asarray(attenuation, dtype=float)
+        self.noise = noise
+        self.amplitude = amplitude
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.powered = False
+        self.pattern = None
+        self.pattern_rate = None
+        self.channels = []
+        self.sample_index = 0
+        self.next_frame_time = None
+
+    def set_powersupply(self):
+        self.powered = True
+
+    def push_pattern(self, buffer, sample_rate, channels):
+        self.pattern = np.asarray(buffer, dtype=np.uint16)
+        self.pattern_rate = sample_rate
+        self.channels = list(channels)
+
+    def acquire(self, samples):
+        frame = self.rng.normal(0.0, self.noise, (2, samples))
+        if self.powered and self.pattern is not None:
+            # Pattern word being output at each ADC sample, the pattern keeps running between frames
+            n = self.sample_index + np.arange(samples)
+            words = self.pattern[(n * self.pattern_rate // self.sample_rate).astype(np.int64) % len(self.pattern)]
+            bits = (words >> np.array(self.channels, dtype=np.uint16)[:, np.newaxis]) & 1
+            frame[0] += self.amplitude * bits.sum(axis=0)
+            frame[1] += self.amplitude * (self.attenuation[:len(self.channels)] @ bits)
+        self.sample_index += samples
+
+        if self.realtime:
+            # Take as long as the real ADC would
+            now = time.monotonic()
+            if self.next_frame_time is None:
+                self.next_frame_time = now
+            self.next_frame_time += samples / self.sample_rate
+            if self.next_frame_time > now:
+                time.sleep(self.next_frame_time - now)
+        return frame
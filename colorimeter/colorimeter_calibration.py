@@ -0,0 +1,101 @@
+import contextlib
+import json
+import os
+import tempfile
+import time
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
+    import msvcrt
+
+# Calibration factors saved between runs, keyed by device and LED frequencies
+# A clear cuvette in both holders should read 100%, the factors correct the photodiode mismatch
+
+DEFAULT_PATH = os.path.join(os.path.expanduser('~'), '.colorimeter', 'calibration.json')
+DEFAULT_MAX_AGE = 7 * 24 * 3600  # in seconds
+
+
+def compute_factors(sample_power, ref_power):
+    # Calibration factors of all colours from N frames at once
+    # sample_power, ref_power = (frames, colours) band powers, see band_powers
+    # Same as 100 / transmittance, with the transmittance averaged over all frames
+    sample_power = np.atleast_2d(sample_power)
+    ref_power = np.atleast_2d(ref_power)
+    return np.sqrt(ref_power.sum(axis=0) / sample_power.sum(axis=0))
+
+
+def calibration_key(device_id, led_freqs):
+    return "{}|{}".format(device_id, ",".join(str(freq) for freq in led_freqs))
+
+
+class CalibrationStore:
+    # JSON file holding one entry per (device, LED frequencies)
+    # Several colorimeter processes may share it: save() holds an exclusive lock on path + '.lock'
+    # while it reads, merges and replaces the file, and a store that cannot be read is treated as empty.
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            # Missing, unreadable or corrupt: same as no calibration, the next save rewrites it
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    @contextlib.contextmanager
+    def _lock(self):
+        with open(self.path + '.lock', 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def load(self, device_id, led_freqs, max_age=DEFAULT_MAX_AGE):
+        # Returns the saved factors, or None if there are none, they are unreadable or older than max_age seconds
+        entry = self._read().get(calibration_key(device_id, led_freqs))
+        try:
+            if max_age is not None and time.time() - entry['timestamp'] > max_age:
+                return None
+            return np.array(entry['factors'], dtype=float)
+        except (TypeError, KeyError, ValueError):
+            return None
+
+    def save(self, device_id, led_freqs, factors, frames=1):
+        entry = {
+            'device_id': device_id,
+            'led_freqs': list(led_freqs),
+            'factors': [float(factor) for factor in factors],
+            'frames': frames,
+            'timestamp': time.time(),
+        }
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        with self._lock():
+            entries = self._read()
+            entries[calibration_key(device_id, led_freqs)] = entry
+            # Write to a temporary file of our own first, so a crash never leaves a half written store
+            handle, temporary = tempfile.mkstemp(dir=directory, prefix='.calibration-', suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'w') as f:
+                    json.dump(entries, f, indent=2)
+                os.replace(temporary, self.path)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.remove(temporary)
+                raise
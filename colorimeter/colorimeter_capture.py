@@ -0,0 +1,181 @@
+import json
+import os
+import time
+import numpy as np
+import colorimeter_functions
+
+# Capture file layout
+#
+#   0     8 bytes   magic
+#   8     uint64    number of frames written
+#   16    uint32    length of the JSON metadata
+#   20    JSON      sample_rate, channels, samples, dtype, led_freqs, calibration, ...
+#   4096  frames    (channels, samples) each, little endian, back to back
+#
+# The frame count is updated after every frame, so a capture cut short by a crash stays readable.
+
+MAGIC = b'COLCAP01'
+HEADER_SIZE = 4096
+
+
+def _write_header(f, count, metadata):
+    text = json.dumps(metadata).encode()
+    if 20 + len(text) > HEADER_SIZE:
+        raise ValueError("Capture metadata does not fit in {} bytes".format(HEADER_SIZE))
+    f.seek(0)
+    f.write(MAGIC)
+    f.write(np.array([count], dtype='<u8').tobytes())
+    f.write(np.array([len(text)], dtype='<u4').tobytes())
+    f.write(text.ljust(HEADER_SIZE - 20))
+
+
+def read_header(path):
+    # Returns (frame count, metadata)
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if header[:8] != MAGIC:
+        raise ValueError("{} is not a colorimeter capture".format(path))
+    count = int(np.frombuffer(header, dtype='<u8', count=1, offset=8)[0])
+    length = int(np.frombuffer(header, dtype='<u4', count=1, offset=16)[0])
+    return count, json.loads(header[20:20 + length])
+
+
+class CaptureWriter:
+    # Appends raw frames to a capture file through memory maps
+    # The file grows chunk_frames frames at a time and is trimmed to the frames written on close()
+    # With append=True an existing capture with the same frame shape is continued
+
+    def __init__(self, path, sample_rate, samples, channels=2, led_freqs=colorimeter_functions.led_freqs,
+                 calibration=None, dtype='<f8', chunk_frames=256, append=False, **extra):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.frame_shape = (channels, samples)
+        self.frame_bytes = channels * samples * self.dtype.itemsize
+        self.chunk_frames = chunk_frames
+        self.metadata = {
+            'sample_rate': sample_rate,
+            'channels': channels,
+            'samples': samples,
+            'dtype': self.dtype.str,
+            'led_freqs': list(led_freqs),
+            'calibration': None if calibration is None else [float(c) for c in calibration],
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+        self.metadata.update(extra)
+
+        if append and os.path.exists(path):
+            self.count, metadata = read_header(path)
+            if (metadata['channels'], metadata['samples'], metadata['dtype']) != \
+                    (channels, samples, self.dtype.str):
+                raise ValueError("{} holds frames of a different shape".format(path))
+            self.metadata = metadata
+            self.file = open(path, 'r+b')
+        else:
+            self.count = 0
+            self.file = open(path, 'w+b')
+            _write_header(self.file, 0, self.metadata)
+            self.file.flush()
+
+        self.count_map = np.memmap(path, dtype='<u8', mode='r+', offset=8, shape=(1,))
+        self.chunk = None
+        self.chunk_start = self.count
+
+    def _map_chunk(self):
+        # Grow the file by one chunk and map it
+        self.chunk_start = self.count
+        offset = HEADER_SIZE + self.chunk_start * self.frame_bytes
+        self.file.truncate(offset + self.chunk_frames * self.frame_bytes)
+        self.chunk = np.memmap(self.path, dtype=self.dtype, mode='r+', offset=offset,
+                               shape=(self.chunk_frames,) + self.frame_shape)
+
+    def append(self, frame):
+        if self.chunk is None or self.count - self.chunk_start == self.chunk_frames:
+            self._map_chunk()
+        self.chunk[self.count - self.chunk_start] = frame
+        self.count += 1
+        self.count_map[0] = self.count
+
+    def close(self, **metadata):
+        # Extra keyword arguments update the metadata, e.g. the calibration found during the run
+        if self.file is None:
+            return
+        if self.chunk is not None:
+            self.chunk.flush()
+            self.chunk = None
+        self.count_map.flush()
+        del self.count_map
+        self.metadata.update(metadata)
+        self.file.truncate(HEADER_SIZE + self.count * self.frame_bytes)
+        _write_header(self.file, self.count, self.metadata)
+        self.file.close()
+        self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CaptureReader:
+    # Zero-copy access to a capture: frames is a read-only memmap of shape (count, channels, samples)
+
+    def __init__(self, path):
+        self.path = path
+        count, self.metadata = read_header(path)
+        self.sample_rate = self.metadata['sample_rate']
+        dtype = np.dtype(self.metadata['dtype'])
+        shape = (count, self.metadata['channels'], self.metadata['samples'])
+        if count:
+            self.frames = np.memmap(path, dtype=dtype, mode='r', offset=HEADER_SIZE, shape=shape)
+        else:
+            # Empty files cannot be mapped
+            self.frames = np.empty(shape, dtype=dtype)
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def blocks(self, batch):
+        # Consecutive views of up to batch frames
+        for start in range(0, len(self.frames), batch):
+            yield self.frames[start:start + batch]
+
+
+def replay_transmittance(path, bins=None, batch=64, calibrate=True, reference=0, channels=None):
+    # Runs a whole capture through the FFT and transmittance code, batch frames per FFT call
+    # bins defaults to the coherent bins of the recorded LED frequencies; in that case the
+    # rectangular window is used, otherwise the Blackman window, as in Colorimeter
+    # channels = sample rows measured against the reference row, every other row by default
+    # Returns an array of shape (frames, colours) for a single sample row, as recorded from a two channel
+    # rig, else (frames, len(channels), colours), with the recorded calibration applied if calibrate
+    reader = CaptureReader(path)
+    samples = reader.metadata['samples']
+    if bins is None:
+        acq_plan = colorimeter_functions.plan_acquisition(reader.sample_rate, reader.metadata['led_freqs'], samples)
+        if acq_plan.samples != samples:
+            raise ValueError("Capture frames are not coherent, pass bins explicitly")
+        bins = acq_plan.bins
+        window = 'rectangular'
+    else:
+        window = 'blackman'
+    if channels is None:
+        channels = [row for row in range(reader.metadata['channels']) if row != reference]
+    table = colorimeter_functions.bin_table(bins)
+
+    spectrum = colorimeter_functions.SpectrumEngine(window)
+    result = np.empty((len(reader), len(channels), len(bins)))
+    position = 0
+    for block in reader.blocks(batch):
+        # (frames, channels, samples) -> one row per channel of every frame, still a view
+        spectra = spectrum.compute(block.reshape(-1, samples)).reshape(len(block), block.shape[1], -1)
+        powers = colorimeter_functions.band_power_matrix(spectra, table)
+        result[position:position + len(block)] = np.sqrt(powers[:, channels] / powers[:, reference:reference + 1]) \
+            * 100
+        position += len(block)
+
+    if calibrate and reader.metadata.get('calibration'):
+        result *= reader.metadata['calibration']
+    return result[:, 0] if len(channels) == 1 else result
@@ -0,0 +1,271 @@
+import argparse
+import csv
+import json
+import sys
+import time
+import numpy as np
+import colorimeter_calibration
+from colorimeter_functions import led_freqs, plan_acquisition
+
+# Headless colorimeter: measures and streams one line per frame, as CSV or JSON lines
+# Nothing is asked interactively, and matplotlib is only imported with --plot
+#
+#   python colorimeter_cli.py --backend ad4630 --frames 100 --format jsonl
+#   python colorimeter_cli.py --backend sim --duration 10 --calibrate run --output run.csv
+#   python colorimeter_cli.py --backend replay --input run.cap --format csv
+#   python colorimeter_cli.py --backend replay --input blackman.cap --bins "[[204, 205], [245, 246], [286, 287]]"
+#   python colorimeter_cli.py --backend ad4630 --metrics /var/lib/node_exporter/colorimeter.prom
+#   python colorimeter_cli.py --backend ad4630 --calibrate auto --lockin 100 --format jsonl
+
+COLOUR_NAMES = ['red', 'green', 'blue']
+
+
+def make_backend(args):
+    # Backends are imported here so only the selected one pulls in its hardware library
+    import colorimeter_backends
+    if args.backend == 'm2k':
+        return colorimeter_backends.M2KBackend(uri=args.uri or "ip:192.168.2.1", sample_rate=args.sample_rate)
+    if args.backend == 'ad4630':
+        return colorimeter_backends.AD4630Backend(adc_uri=args.uri or "ip:192.168.10.2", pg_uri=args.pg_uri,
+                                                  device_name=args.device_name, sample_rate=args.sample_rate)
+    if args.backend == 'sim':
+        return colorimeter_backends.SimulatedBackend(sample_rate=args.sample_rate, realtime=not args.fast,
+                                                     seed=args.seed)
+    if not args.input:
+        raise SystemExit("--backend replay needs --input")
+    return colorimeter_backends.ReplayBackend(args.input, realtime=not args.fast)
+
+
+class RowWriter:
+    # Writes one measurement per line and flushes it, so a supervisor sees results as they come
+
+    def __init__(self, stream, fmt, colours, confidence=False):
+        self.stream = stream
+        self.fmt = fmt
+        self.fields = ['frame', 'time'] + colours
+        if confidence:
+            # Half width of the 95% confidence interval of each averaged colour
+            self.fields += [colour + '_ci' for colour in colours]
+        if fmt == 'csv':
+            self.csv = csv.writer(stream)
+            self.csv.writerow(self.fields)
+
+    def write(self, frame, timestamp, transmittance, confidence=()):
+        values = [frame, round(timestamp, 6)] + [float(t) for t in transmittance] + [float(c) for c in confidence]
+        if self.fmt == 'csv':
+            self.csv.writerow(values)
+        else:
+            self.stream.write(json.dumps(dict(zip(self.fields, values))) + '\n')
+        self.stream.flush()
+
+
+def run_lockin(demodulator, data, colorimeter, writer, averager, frame, frames, metrics):
+    # Writes one row per lock-in window completed by this chunk, timed by sample position
+    # Returns the next output number and the last transmittance written, None if no window completed
+    start = metrics.clock()
+    powers = demodulator.process(data)
+    metrics.lap('lockin', start)
+    transmittance = None
+    for ref_power, sample_power in powers[:, :2]:
+        if frames is not None and frame >= frames:
+            break
+        timestamp = frame / demodulator.output_rate
+        if averager is None:
+            transmittance = np.sqrt(sample_power / ref_power) * 100 * colorimeter.calibration
+            writer.write(frame, timestamp, transmittance)
+        else:
+            transmittance = averager.update_powers(sample_power, ref_power)
+            low, high = averager.confidence_interval()
+            transmittance = transmittance * colorimeter.calibration
+            writer.write(frame, timestamp, transmittance, (high - low) / 2 * colorimeter.calibration)
+        frame += 1
+    return frame, transmittance
+
+
+def chunk_spectra(colorimeter, data):
+    # FFT magnitudes of a lock-in chunk for the live plot, scaled like Measurement spectra
+    spectra = colorimeter.spectrum.compute(data[:2])
+    return [2.0 / len(spectrum) * np.abs(spectrum) for spectrum in spectra]
+
+
+def coherent_frames(sample_rate, samples):
+    # True if frames of this length put every LED tone on a single bin, as Colorimeter plans them
+    try:
+        return plan_acquisition(sample_rate, led_freqs, samples).samples == samples
+    except ValueError:
+        return False
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Headless colorimeter, one transmittance line per frame")
+    parser.add_argument('--backend', choices=['ad4630', 'm2k', 'sim', 'replay'], default='ad4630')
+    parser.add_argument('--uri', help="ADC URI (default: ip:192.168.10.2 for ad4630, ip:192.168.2.1 for m2k)")
+    parser.add_argument('--pg-uri', default="ip:192.168.2.1", help="M2K URI driving the LED, for ad4630")
+    parser.add_argument('--device-name', default="ad4630-16")
+    parser.add_argument('--sample-rate', type=int, default=10000, help="ADC sample rate in Sa/s")
+    parser.add_argument('--input', help="capture file for --backend replay")
+    parser.add_argument('--fast', action='store_true', help="sim/replay: do not pace frames in real time")
+    parser.add_argument('--seed', type=int, help="sim: random seed")
+    parser.add_argument('--bins', type=json.loads, metavar='JSON',
+                        help="FFT bins of each colour, e.g. \"[[205], [246], [287]]\": keeps 4096 sample frames (the "
+                             "recorded length on replay) with the Blackman window instead of coherent frames")
+    parser.add_argument('--calibrate', choices=['none', 'run', 'load', 'auto'], default='none',
+                        help="run: calibrate now, clear cuvettes in both holders, and save the factors; "
+                             "load: use saved factors, fail if missing or stale; auto: load, else run")
+    parser.add_argument('--calibration-frames', type=int, default=16, help="frames averaged by --calibrate run")
+    parser.add_argument('--calibration-file', default=colorimeter_calibration.DEFAULT_PATH)
+    parser.add_argument('--max-age', type=float, default=colorimeter_calibration.DEFAULT_MAX_AGE,
+                        help="saved calibrations older than this many seconds are stale")
+    parser.add_argument('--average', choices=['none', 'cumulative', 'sliding', 'exponential'], default='none',
+                        help="average band powers over frames and add confidence intervals")
+    parser.add_argument('--window', type=int, default=16, help="frames in the sliding average")
+    parser.add_argument('--alpha', type=float, default=0.1, help="weight of each new frame in the exponential average")
+    parser.add_argument('--lockin', type=float, metavar='RATE',
+                        help="stream lock-in results at about RATE per second instead of one per FFT frame")
+    parser.add_argument('--chunk', type=int, help="--lockin: samples per acquisition (default: one output window)")
+    parser.add_argument('--frames', type=int, help="stop after this many frames (lock-in outputs with --lockin)")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv')
+    parser.add_argument('--output', help="write here instead of stdout")
+    parser.add_argument('--record', help="also save raw frames to this capture file")
+    parser.add_argument('--plot', action='store_true', help="show the live plot (needs a display)")
+    parser.add_argument('--metrics', help="write per-stage latency, frame rate and counters to this file")
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                        help="default: prometheus for .prom files, json otherwise")
+    parser.add_argument('--metrics-interval', type=float, default=5.0, help="seconds between metrics writes")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from colorimeter_engine import Colorimeter
+    from colorimeter_metrics import NULL_METRICS, Metrics, MetricsExporter
+
+    metrics = NULL_METRICS
+    exporter = None
+    if args.metrics:
+        fmt = args.metrics_format or ('prometheus' if args.metrics.endswith('.prom') else 'json')
+        metrics = Metrics()
+        exporter = MetricsExporter(metrics, args.metrics, fmt, args.metrics_interval)
+
+    backend = make_backend(args)
+    if args.backend == 'replay':
+        # Keep the recorded frame length and calibration
+        samples = backend.reader.metadata['samples']
+        if args.bins is None and not coherent_frames(backend.sample_rate, samples):
+            backend.close()
+            nearest = [[round(freq * samples / backend.sample_rate)] for freq in led_freqs]
+            raise SystemExit("{} holds frames of {} samples, not a coherent frame length for {} Hz at {} Sa/s; "
+                             "pass the bins it was measured with, e.g. --bins \"{}\"".format(
+                                 args.input, samples, led_freqs, backend.sample_rate, nearest))
+        colorimeter = Colorimeter(backend, bins=args.bins, min_samples=samples, metrics=metrics)
+        if backend.reader.metadata.get('calibration'):
+            colorimeter.calibration = np.array(backend.reader.metadata['calibration'])
+    elif args.bins is not None:
+        colorimeter = Colorimeter(backend, bins=args.bins, metrics=metrics)
+    else:
+        colorimeter = Colorimeter(backend, metrics=metrics)
+    if exporter is not None:
+        exporter.start()
+    colorimeter.start()
+
+    store = colorimeter_calibration.CalibrationStore(args.calibration_file)
+    calibrate = args.calibrate
+    if calibrate in ('load', 'auto'):
+        if colorimeter.load_calibration(store, args.max_age):
+            calibrate = 'loaded'
+        elif calibrate == 'load':
+            colorimeter.close()
+            raise SystemExit("No calibration younger than {} s for {} in {}".format(
+                args.max_age, backend.device_id, args.calibration_file))
+    if calibrate in ('run', 'auto'):
+        colorimeter.calibrate_frames(args.calibration_frames, store)
+        if not backend.saves_calibration:
+            print("Calibration measured on replayed frames, not saved for {}".format(backend.device_id),
+                  file=sys.stderr)
+    if calibrate != 'none':
+        print("Calibration factors: {}".format(colorimeter.calibration.tolist()), file=sys.stderr)
+
+    demodulator = None
+    if args.lockin:
+        # A replayed capture can only be read in the frames it was recorded with
+        chunk = backend.reader.metadata['samples'] if args.backend == 'replay' else args.chunk
+        try:
+            demodulator = colorimeter.lockin(args.lockin, chunk)
+        except ValueError as error:
+            colorimeter.close()
+            raise SystemExit(str(error))
+        print("Lock-in: {} samples per output, {:g} outputs/s".format(demodulator.decimation,
+                                                                      demodulator.output_rate), file=sys.stderr)
+
+    if args.record:
+        colorimeter.record(args.record)
+
+    plot = None
+    if args.plot:
+        from colorimeter_plot import LivePlot
+        plot = LivePlot(colorimeter.samples // 2, fft_ylim=1200)
+
+    stream = open(args.output, 'w', newline='') if args.output else sys.stdout
+    colours = COLOUR_NAMES if len(colorimeter.led_tones) == 3 else \
+        ['tone{}'.format(i) for i in range(len(colorimeter.led_tones))]
+    writer = RowWriter(stream, args.format, colours, confidence=args.average != 'none')
+    averager = None
+    if args.average != 'none':
+        from colorimeter_functions import TransmittanceAverager
+        averager = TransmittanceAverager(len(colours), args.average, args.window, args.alpha)
+
+    start = time.monotonic()
+    frame = 0
+    try:
+        while args.frames is None or frame < args.frames:
+            if args.duration is not None and time.monotonic() - start >= args.duration:
+                break
+            try:
+                data = colorimeter.acquire()
+            except EOFError:
+                break
+            if demodulator is not None:
+                frame, transmittance = run_lockin(demodulator, data, colorimeter, writer, averager, frame,
+                                                  args.frames, metrics)
+                if plot is not None:
+                    if not plot.is_open():
+                        break
+                    if transmittance is not None:
+                        lap = metrics.clock()
+                        plot.update(*chunk_spectra(colorimeter, data), transmittance)
+                        metrics.lap('plot', lap)
+                continue
+            # Without the plot only the LED bins are evaluated, not the whole spectrum
+            measurement = colorimeter.measure(data, spectrum=plot is not None)
+            transmittance = measurement.transmittance
+            lap = metrics.clock()
+            if averager is None:
+                writer.write(frame, time.monotonic() - start, transmittance)
+            else:
+                transmittance = averager.update_powers(measurement.sample_power, measurement.ref_power)
+                low, high = averager.confidence_interval()
+                transmittance = transmittance * colorimeter.calibration
+                confidence = (high - low) / 2 * colorimeter.calibration
+                writer.write(frame, time.monotonic() - start, transmittance, confidence)
+            lap = metrics.lap('output', lap)
+            frame += 1
+
+            if plot is not None:
+                if not plot.is_open():
+                    break
+                plot.update(measurement.ref_spectrum, measurement.sample_spectrum, transmittance)
+                metrics.lap('plot', lap)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        colorimeter.close()
+        if exporter is not None:
+            exporter.stop()
+        if stream is not sys.stdout:
+            stream.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import collections
+import numpy as np
+import colorimeter_calibration
+import colorimeter_functions
+from colorimeter_metrics import NULL_METRICS
+from colorimeter_pipeline import ColorimeterPipeline
+
+# raw = transmittance before calibration, transmittance = calibrated, both in % per colour
+# ref_spectrum, sample_spectrum = FFT magnitudes for plotting
+# ref_power, sample_power = band power per colour, for TransmittanceAverager
+Measurement = collections.namedtuple('Measurement', ['raw', 'transmittance', 'ref_spectrum', 'sample_spectrum',
+                                                     'ref_power', 'sample_power'])
+
+
+class Colorimeter:
+    # Everything the colorimeter does, on top of any Backend from colorimeter_backends
+    #
+    # start() powers the board and drives the LED, acquire() reads one frame,
+    # measure(frame) turns it into a Measurement. acquire() and measure() can run in
+    # different threads, see ColorimeterPipeline.
+    #
+    # By default the frame length is planned so every LED tone falls on a single bin,
+    # and a rectangular window is used. Passing bins (red_bins, green_bins, blue_bins)
+    # keeps the 4096 sample frame and the Blackman window instead.
+    #
+    # metrics = a colorimeter_metrics.Metrics to time each stage, off by default
+
+    def __init__(self, backend, led_tones=colorimeter_functions.led_tones, bins=None, min_samples=4096,
+                 metrics=NULL_METRICS):
+        self.backend = backend
+        self.metrics = metrics
+        self.led_tones = list(led_tones)
+        self.led_freqs = [freq for freq, channel in self.led_tones]
+
+        if bins is None:
+            self.acq_plan = colorimeter_functions.plan_acquisition(backend.sample_rate, self.led_freqs,
+                                                                   min_samples)
+            self.samples = self.acq_plan.samples
+            self.bins = self.acq_plan.bins
+            window = 'rectangular'
+        else:
+            self.acq_plan = None
+            self.samples = min_samples
+            self.bins = bins
+            window = 'blackman'
+        self.window = window
+        self.bin_table = colorimeter_functions.bin_table(self.bins)
+        # Same colour groups over the output of sparse_fft, which holds only the table bins
+        self.sparse_table = colorimeter_functions.BinTable(np.arange(len(self.bin_table.bins)),
+                                                           self.bin_table.starts)
+        self.spectrum = colorimeter_functions.SpectrumEngine(window)
+
+        # Calibration values for each colour, 1 has no effect on the light transmittance
+        self.calibration = np.ones(len(self.led_tones))
+        self.recorder = None
+
+    def start(self):
+        # Enable and set power supply pins to +5, -5 V to power up OP Amp
+        self.backend.set_powersupply()
+
+        # Create digital buffer, to be pushed to Digital Outputs
+        # This is used to drive the RGB LED
+        pg_plan = colorimeter_functions.optimize_pg_sample_rate(self.led_freqs)
+        if pg_plan is None:
+            raise ValueError("No pattern generator rate fits {} in one buffer of at most {} samples".format(
+                self.led_freqs, colorimeter_functions.max_buffer_size))
+        digital_buffer = colorimeter_functions.compose_digital_buffer(self.led_tones, pg_plan.rate)
+        self.backend.push_pattern(digital_buffer, pg_plan.rate, [channel for freq, channel in self.led_tones])
+        return self
+
+    def acquire(self):
+        start = self.metrics.clock()
+        frame = self.backend.acquire(self.samples)
+        start = self.metrics.lap('acquire', start)
+        if self.recorder is not None:
+            self.recorder.append(frame)
+            self.metrics.lap('record', start)
+        self.metrics.count('frames')
+        return frame
+
+    def record(self, path, append=False):
+        # Save every acquired frame to a capture file, see colorimeter_capture
+        from colorimeter_capture import CaptureWriter
+        self.recorder = CaptureWriter(path, self.backend.sample_rate, self.samples, self.backend.rows,
+                                      led_freqs=self.led_freqs, calibration=self.calibration, append=append,
+                                      uri=self.backend.uri, device_id=self.backend.device_id,
+                                      contiguous=self.backend.contiguous and not append)
+        return self.recorder
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close(calibration=[float(c) for c in self.calibration])
+            self.recorder = None
+
+    def measure(self, frame, spectrum=True):
+        # Compute FFT
+        # The compute_fft method defined will return only the positive side of the spectrum
+        # Row 0 is the reference, row 1 the sample, further rows are ignored here, see measure_channels
+        # spectrum=False skips the full FFT when nothing is plotted: only the LED bins are evaluated,
+        # see sparse_fft, and the Measurement has no spectra
+        start = self.metrics.clock()
+        if not spectrum:
+            bin_ffts = colorimeter_functions.sparse_fft(frame[:2], self.bin_table.bins, self.window)
+            start = self.metrics.lap('fft', start)
+            ref_power, sample_power = colorimeter_functions.band_power_matrix(bin_ffts, self.sparse_table)
+            raw = np.sqrt(sample_power / ref_power) * 100
+            self.metrics.lap('transmittance', start)
+            return Measurement(raw, raw * self.calibration, None, None, ref_power, sample_power)
+
+        spectra = self.spectrum.compute(frame)
+        ref_data_fft, measured_data_fft = spectra[0], spectra[1]
+        start = self.metrics.lap('fft', start)
+
+        # Compute Light transmittance, same as light_transmittance but keeping the band powers
+        ref_power, sample_power = colorimeter_functions.band_power_matrix(spectra[:2], self.bin_table)
+        raw = np.sqrt(sample_power / ref_power) * 100
+        # Spectra for the FFT plot, copied out of the engine buffers
+        data_ref = 2.0 / len(ref_data_fft) * np.abs(ref_data_fft)
+        data_sample = 2.0 / len(measured_data_fft) * np.abs(measured_data_fft)
+        self.metrics.lap('transmittance', start)
+        return Measurement(raw, raw * self.calibration, data_ref, data_sample, ref_power, sample_power)
+
+    def measure_channels(self, frame):
+        # Uncalibrated transmittance of every sample row of a multi-channel frame against row 0,
+        # as a (channels - 1, colours) array, e.g. from AD4630Backend(channels=(0, 1, 2, 3))
+        return colorimeter_functions.transmittance_matrix(frame, self.bin_table, window=self.window)
+
+    def lockin(self, output_rate=100.0, chunk=None):
+        # Switch to streaming lock-in demodulation, see colorimeter_lockin
+        # From now on acquire() returns frames of chunk samples, one demodulator window by default;
+        # feed them to the returned LockInDemodulator instead of measure()
+        # Windows only carry over from one chunk to the next on a contiguous backend, any other
+        # backend needs chunks of whole windows
+        from colorimeter_lockin import LockInDemodulator
+        demodulator = LockInDemodulator(self.backend.sample_rate, self.led_freqs, output_rate)
+        chunk = chunk or demodulator.decimation
+        if not self.backend.contiguous and chunk % demodulator.decimation:
+            raise ValueError("Every acquisition of this backend is a separate capture, chunks of {} samples would "
+                             "mix two of them in one lock-in window; use a multiple of {} samples".format(
+                                 chunk, demodulator.decimation))
+        self.samples = chunk
+        return demodulator
+
+    def calibrate(self, measurement):
+        # Clear cuvettes in both reference and sample should read 100%
+        self.calibration = 100.0 / measurement.raw
+        return self.calibration
+
+    def calibrate_frames(self, frames=16, store=None):
+        # Calibrate on the average of several frames, and save the result if a CalibrationStore is given
+        # and the backend is the live board (a replay only reuses the recorded board's device_id)
+        start = self.metrics.clock()
+        measurements = [self.measure(self.acquire(), spectrum=False) for i in range(frames)]
+        self.calibration = colorimeter_calibration.compute_factors([m.sample_power for m in measurements],
+                                                                   [m.ref_power for m in measurements])
+        if store is not None and self.backend.saves_calibration:
+            store.save(self.backend.device_id, self.led_freqs, self.calibration, frames)
+        self.metrics.lap('calibration', start)
+        return self.calibration
+
+    def load_calibration(self, store, max_age=colorimeter_calibration.DEFAULT_MAX_AGE):
+        # Use the factors saved for this device and these LED frequencies, returns False if there are
+        # none younger than max_age seconds
+        factors = store.load(self.backend.device_id, self.led_freqs, max_age)
+        if factors is None or len(factors) != len(self.led_tones):
+            return False
+        self.calibration = factors
+        return True
+
+    def close(self):
+        self.stop_recording()
+        self.backend.close()
+
+
+def run_live(colorimeter, fft_ylim, interval=0.05, on_measurement=None, calibration_frames=16,
+             store=colorimeter_calibration.CalibrationStore()):
+    # Interactive loop shared by the colorimeter scripts: ask for calibration, then plot and print
+    # every new measurement until the figure is closed. on_measurement(red_tr, green_tr, blue_tr)
+    # runs after each one.
+    # A calibration saved earlier for the same board is loaded right away, store=None disables that.
+    from colorimeter_plot import LivePlot
+
+    colorimeter.start()
+
+    # Create figure to plot results: FFT plot on top, transmittance bars below
+    # The plot redraws only what changed, at most 10 times per second
+    plot = LivePlot(colorimeter.samples // 2, fft_ylim=fft_ylim, max_fps=10)
+
+    # The photo diodes are slightly mismatched. This sometimes results in values over 100% for light transmittance
+    # In order to avoid that, we can run a simple calibration routine
+    # But, hey, don't take our word for it. Type in 'n', and check the results
+    if store is not None and colorimeter.load_calibration(store):
+        print("\n Loaded saved calibration factors: " + str(colorimeter.calibration.tolist()) + " \n")
+    resp = input("Would you like to run a calibration? \n If so, place clear cuvettes in both "
+                 "reference and sample. Type y or n , then press Enter. \n")
+
+    # Ensure response is typed in correctly
+    resp = resp.strip().lower()  # This removes all whitespaces
+
+    # Calibrate transmittance results, so we cannot go over 100%
+    # The factors are averaged over several frames and saved for the next start
+    if resp == 'y':
+        red_cal, green_cal, blue_cal = colorimeter.calibrate_frames(calibration_frames, store)
+        print("\n Calibration factors \n")
+        print("\n Red :" + str(red_cal) + " \n")
+        print("\n Green :" + str(green_cal) + " \n")
+        print("\n Blue :" + str(blue_cal) + " \n")
+
+    # Acquisition and processing run in background threads, so the ADC keeps streaming
+    # while the plot below refreshes at its own rate
+    pipeline = ColorimeterPipeline(colorimeter.acquire, colorimeter.measure).start()
+    metrics = colorimeter.metrics
+
+    # Where the magic happens
+    try:
+        while plot.is_open():
+            measurement = pipeline.latest()
+            if metrics.enabled:
+                stats = pipeline.stats()
+                for name in ('backlog', 'frames_dropped', 'results_skipped'):
+                    metrics.gauge(name, stats[name])
+            if measurement is not None:
+                transmittance = measurement.transmittance
+
+                # We are not interested in decimals here, so we're keeping only the truncated integer number
+                # from the computed transmittance values
+                start = metrics.clock()
+                plot.update(measurement.ref_spectrum, measurement.sample_spectrum, np.trunc(transmittance))
+                metrics.lap('plot', start)
+
+                red_tr, green_tr, blue_tr = transmittance
+                print("Red Light Transmittance ----- {:.2f}".format(red_tr) + "% \n")
+                print("Green Light Transmittance ----- {:.2f}".format(green_tr) + "% \n")
+                print("Blue Light Transmittance ----- {:.2f}".format(blue_tr) + "% \n")
+                print("Frames acquired: {frames_acquired}, dropped: {frames_dropped}, "
+                      "not displayed: {results_skipped}".format(**pipeline.stats()))
+
+                if on_measurement is not None:
+                    on_measurement(red_tr, green_tr, blue_tr)
+
+            start = metrics.clock()
+            plot.wait(interval)
+            metrics.lap('wait', start)
+    finally:
+        # Exit loop and close the hardware
+        pipeline.stop()
+        colorimeter.close()
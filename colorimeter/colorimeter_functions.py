@@ -1,8 +1,11 @@
+import collections
+import fractions
+import functools
 import math
-import copy
 import numpy as np
 
 max_buffer_size = 500000
+max_frame_size = 1048576  # longest ADC frame plan_acquisition will propose
 
 pg_available_sample_rates = [1000, 10000, 100000, 1000000, 10000000, 100000000]
 pg_max_rate = pg_available_sample_rates[-1]  # last sample rate = max rate
@@ -14,36 +17,68 @@ red_freq = 500  # in Hz
 green_freq = 600  # in Hz
 blue_freq = 700  # in Hz
 
+# (frequency, DIO channel) for each LED colour
+led_tones = [(red_freq, pg_channels[13]), (green_freq, pg_channels[14]), (blue_freq, pg_channels[15])]
+led_freqs = [freq for freq, channel in led_tones]
 
-def get_best_ratio(ratio):
-    max_it = max_buffer_size / ratio
-    best_ratio = ratio
-    best_fract = 1
 
-    for i in range(1, int(max_it)):
-        new_ratio = i * ratio
-        (new_fract, integral) = math.modf(new_ratio)
-        if new_fract < best_fract:
-            best_fract = new_fract
-            best_ratio = new_ratio
-        if new_fract == 0:
-            break
+# samples = buffer length, periods = whole periods of the tone in that buffer
+# error = samples left over (phase error) each time the buffer wraps around
+PeriodPlan = collections.namedtuple('PeriodPlan', ['samples', 'periods', 'error'])
 
-    return best_ratio, best_fract
+# Joint plan for a set of tones sharing one cyclic buffer
+# periods, phase_errors and freq_errors hold one entry per tone, for the whole buffer
+# freq_errors = generated frequency - requested frequency, in Hz
+BufferPlan = collections.namedtuple('BufferPlan', ['rate', 'samples', 'periods', 'phase_errors', 'freq_errors'])
 
 
-def get_samples_count(rate, freq):
+@functools.lru_cache(maxsize=1024)
+def plan_period(rate, freq, max_size=max_buffer_size):
+    # Best rational approximation samples / periods of rate / freq
+    # with samples <= max_size. Exact whenever rate / freq is rational enough
+    # to fit, e.g. 10000 / 600 -> 50 samples for 3 periods
+    # Returns None if not even one period fits in max_size
+    ratio = fractions.Fraction(rate) / fractions.Fraction(freq)
+    max_periods = int(max_size / ratio)
+    if max_periods < 1:
+        return None
+
+    # |samples - periods * ratio| < 1 and periods * ratio <= max_size, so samples always fits
+    approx = ratio.limit_denominator(max_periods)
+    error = float(abs(approx.numerator - approx.denominator * ratio))
+    # A float ratio such as 10000 / 600 is only its nearest binary value, an error within its
+    # rounding (one ulp per period) means the ratio was exact
+    if error <= approx.denominator * math.ulp(float(ratio)):
+        error = 0.0
+    return PeriodPlan(approx.numerator, approx.denominator, error)
+
+
+def get_best_ratio(ratio):
+    plan = plan_period(ratio, 1)
+    if plan is None:
+        return ratio, 1
+    # ratio = number of samples holding a whole number of periods
+    # fract = what is left over - error
+    return plan.samples, plan.error
+
+
+def get_period_samples(rate, freq):
+    # Shortest buffer holding a whole number of periods of freq
+    # Returns 0 if freq cannot be generated at this rate
     ratio = rate / freq
     if ratio < min_nr_of_points and rate < pg_max_rate:
         return 0
     if ratio < 2:
         return 0
 
-    ratio, fract = get_best_ratio(ratio)
-    # ratio = number of periods in buffer
-    # fract = what is left over - error
+    plan = plan_period(rate, freq)
+    if plan is None:
+        return 0
+    return plan.samples
+
 
-    size = int(ratio)
+def pad_buffer_length(size):
+    # Grow a buffer length to a multiple of 4 and at least 1024 samples
     while size & 0x03:
         size = size << 1
     while size < 1024:
@@ -51,55 +86,110 @@ def get_samples_count(rate, freq):
     return size
 
 
-def get_optimal_sample_rate_pg(freq):
-    for rate in pg_available_sample_rates:
-        buf_size = get_samples_count(rate, freq)
-    if buf_size:
-        return rate
+def plan_buffer(rate, freqs, max_size=max_buffer_size):
+    # Plan one cyclic buffer for several tones at once
+    # The length is a multiple of every tone period, so each tone wraps around cleanly
+    # Returns None if a tone cannot be generated or the buffer does not fit in max_size
+    return _plan_buffer(rate, tuple(freqs), max_size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _plan_buffer(rate, freqs, max_size):
+    periods = [get_period_samples(rate, freq) for freq in freqs]
+    if not all(periods):
+        return None
+
+    samples = pad_buffer_length(math.lcm(*periods))
+    if samples > max_size:
+        return None
+
+    plans = [plan_period(rate, freq) for freq in freqs]
+    repeats = [samples // plan.samples for plan in plans]
+    return BufferPlan(rate, samples,
+                      tuple(plan.periods * n for plan, n in zip(plans, repeats)),
+                      tuple(plan.error * n for plan, n in zip(plans, repeats)),
+                      tuple(rate * plan.periods / plan.samples - freq for plan, freq in zip(plans, freqs)))
+
+
+def optimize_pg_sample_rate(freqs, rates=pg_available_sample_rates, max_size=max_buffer_size):
+    # Try every pattern generator rate and keep the smallest buffer that fits all tones
+    # Ties go to the smallest frequency error, then to the lower rate
+    # Returns the BufferPlan, or None if no rate works
+    best_plan = None
+    best_key = None
+    for rate in rates:
+        plan = plan_buffer(rate, freqs, max_size)
+        if plan is None:
+            continue
+        key = (plan.samples, max(abs(err) for err in plan.freq_errors), rate)
+        if best_key is None or key < best_key:
+            best_plan = plan
+            best_key = key
+    return best_plan
 
 
-def square_buffer_generator(freq, phase, sample_rate, dutycycle=0.5):
-    buffer = []
+def get_samples_count(rate, freq):
+    size = get_period_samples(rate, freq)
+    if not size:
+        return 0
+    return pad_buffer_length(size)
+
+
+def get_optimal_sample_rate_pg(freq):
+    plan = optimize_pg_sample_rate([freq])
+    if plan:
+        return plan.rate
+
 
-    nr_of_samples = get_samples_count(sample_rate, freq)
+def square_buffer_array(freq, phase, sample_rate, dutycycle=0.5, nr_of_samples=None):
+    # Same pattern as square_buffer_generator, built in one vectorized expression
+    # Returns a compact np.uint8 array of 0/1 values
+    if nr_of_samples is None:
+        nr_of_samples = get_samples_count(sample_rate, freq)
     samples_per_period = sample_rate / freq
     phase_in_samples = ((phase / 360) * samples_per_period)
     scaler = freq / sample_rate
     shift: float = dutycycle / 2
-    for i in range(nr_of_samples):
-        val = 0 if (((i + phase_in_samples) * scaler + shift) % 1 < dutycycle) else 1
-        buffer.append(val)
-
-    return buffer
+    i = np.arange(nr_of_samples)
+    return (((i + phase_in_samples) * scaler + shift) % 1 >= dutycycle).astype(np.uint8)
 
 
-def square_wave_digital(sig, channel):
+def square_wave_digital_array(sig, channel):
     # shifts buffer to the corresponding DIO channel
-    dig_buf = list(map(lambda s: int(s) << channel, sig))
-    for i in range(8):
-        dig_buf.extend(dig_buf)
-    return dig_buf
-
-
-def lcm(x, y, z):
-    gcd2 = math.gcd(y, z)
-    gcd3 = math.gcd(x, gcd2)
+    # Returns a single period as np.uint16 DIO words, without the 256x repeat
+    return np.asarray(sig, dtype=np.uint16) << np.uint16(channel)
 
-    lcm2 = y * z // gcd2
-    lcm3 = x * lcm2 // math.gcd(x, lcm2)
-    return int(lcm3)
 
+def square_buffer_generator(freq, phase, sample_rate, dutycycle=0.5):
+    return square_buffer_array(freq, phase, sample_rate, dutycycle).tolist()
 
-def extend_buffer(buf, desired_length):
-    times = int(desired_length / len(buf))
-    aux = copy.deepcopy(buf)
 
-    for i in range(1, times):
-        buf.extend(aux)
-    return buf
+def square_wave_digital(sig, channel):
+    # shifts buffer to the corresponding DIO channel
+    # The period is repeated 256 times, keeping the original list layout
+    dig_buf = np.tile(square_wave_digital_array(sig, channel), 256)
+    return dig_buf.tolist()
+
+
+def compose_digital_buffer(tones, sample_rate, phase=0, dutycycle=0.5):
+    # Build one cyclic DIO buffer for any number of (freq, channel) tones
+    # Each tone is generated for a single period only, then tiled up to the
+    # shortest length that holds a whole number of periods of every tone
+    plan = plan_buffer(sample_rate, [freq for freq, channel in tones])
+    if plan is None:
+        raise ValueError("Cannot fit {} in one buffer at {} Sa/s".format(
+            [freq for freq, channel in tones], sample_rate))
+
+    buffer_length = plan.samples
+    buffer = np.zeros(buffer_length, dtype=np.uint16)
+    for freq, channel in tones:
+        period = get_period_samples(sample_rate, freq)
+        sig = square_buffer_array(freq, phase, sample_rate, dutycycle, period)
+        buffer |= np.tile(square_wave_digital_array(sig, channel), buffer_length // period)
+    return buffer
 
 
-def create_digital_buffer():
+def create_digital_buffer(sample_rate=pg_available_sample_rates[1]):
     # Create 3 digital clock pattern buffers at 3 different frequencies
     # We will use these to drive the RGB LED
     # Each signal will turn the LED either Red, Blue or Green
@@ -109,44 +199,113 @@ def create_digital_buffer():
     square_offset = 0
     square_phase = 0
 
-    sig = square_buffer_generator(red_freq, square_phase, pg_available_sample_rates[1], square_dutycycle)
-    red_buf = square_wave_digital(sig, pg_channels[13])
-
-    sig = square_buffer_generator(green_freq, square_phase, pg_available_sample_rates[1], square_dutycycle)
-    green_buf = square_wave_digital(sig, pg_channels[14])
+    # The bit-planes for DIO13, DIO14 and DIO15 are OR-ed into a single buffer
+    # libm2k expects a list of ints, so convert at the very end
+    buffer = compose_digital_buffer(led_tones, sample_rate, square_phase, square_dutycycle)
+    return buffer.tolist()
 
-    sig = square_buffer_generator(blue_freq, square_phase, pg_available_sample_rates[1], square_dutycycle)
-    blue_buf = square_wave_digital(sig, pg_channels[15])
 
-    # Make sure all buffers are the same length
-    # Find The Least Common Multiple(LCM) between the lengths of the 3 buffers
-    # Extend each buffer until they are the length of LCM
+@functools.lru_cache(maxsize=16)
+def fft_window(n, window='blackman'):
+    # Cached window, shared by every FFT of length n
+    # 'rectangular' is only useful for coherent frames, see plan_acquisition
+    if window == 'blackman':
+        data = np.blackman(n)
+    elif window == 'rectangular':
+        data = np.ones(n)
+    else:
+        raise ValueError("Unknown window: {}".format(window))
+    data.flags.writeable = False
+    return data
 
-    buffer_length = lcm(len(red_buf), len(green_buf), len(blue_buf))
-    red_buf = extend_buffer(red_buf, buffer_length)
-    blue_buf = extend_buffer(blue_buf, buffer_length)
-    green_buf = extend_buffer(green_buf, buffer_length)
 
-    buffer = []
-    if len(red_buf) == len(blue_buf) == len(green_buf):
-        for i in range(len(red_buf)):
-            bit = red_buf[i] + blue_buf[i] + green_buf[i]
-            buffer.append(bit)
-
-    return buffer
-
-
-def compute_fft(data):
+def compute_fft(data, window='blackman'):
     # Remove DC offset
     data_no_dc = data - np.mean(data)
     # Apply Blackman window
-    windowed_signal = data_no_dc * np.blackman(len(data_no_dc))
-    data_fft = np.fft.fft(windowed_signal)
+    windowed_signal = data_no_dc * fft_window(len(data_no_dc), window)
+    # Real input, so the real FFT already gives the positive half of the spectrum
+    data_fft = np.fft.rfft(windowed_signal)
     # return only positive half of the spectrum.
-    data_fft = data_fft[:len(data_fft) // 2]
+    data_fft = data_fft[:len(data_no_dc) // 2]
     return data_fft # Note that this is still complex data.
 
 
+class SpectrumEngine:
+    # Reusable version of compute_fft for 2-D blocks (reference and sample channels, or many frames)
+    # All rows are processed in one call, into buffers allocated once per block shape
+    # The returned spectra are views into those buffers and are overwritten by the next call
+
+    def __init__(self, window='blackman'):
+        self.window_type = window
+        self.shape = None
+
+    def _allocate(self, shape):
+        rows, n = shape
+        self.shape = shape
+        self.window = fft_window(n, self.window_type)
+        self.mean = np.empty((rows, 1))
+        self.work = np.empty(shape)
+        self.out = np.empty((rows, n // 2 + 1), dtype=complex)
+
+    def compute(self, block):
+        block = np.asarray(block)
+        single = block.ndim == 1
+        block = np.atleast_2d(block)
+        if block.shape != self.shape:
+            self._allocate(block.shape)
+
+        # Remove DC offset and apply the window, in place
+        np.mean(block, axis=1, keepdims=True, out=self.mean)
+        np.subtract(block, self.mean, out=self.work)
+        np.multiply(self.work, self.window, out=self.work)
+        try:
+            np.fft.rfft(self.work, axis=1, out=self.out)
+        except TypeError:
+            # NumPy < 2.0 has no out argument
+            self.out[...] = np.fft.rfft(self.work, axis=1)
+
+        # Same length as compute_fft: positive half without the Nyquist bin
+        data_fft = self.out[:, :block.shape[1] // 2]
+        return data_fft[0] if single else data_fft
+
+
+# sample_rate and samples = ADC rate and frame length to acquire
+# bins = one array per tone holding its single FFT bin, usable as red_bins, green_bins, ...
+AcquisitionPlan = collections.namedtuple('AcquisitionPlan', ['sample_rate', 'samples', 'bins'])
+
+
+def plan_acquisition(sample_rate, freqs, min_samples=4096, max_samples=max_frame_size):
+    # Choose the shortest frame of at least min_samples where every tone lands exactly on a bin
+    # With such a frame, a rectangular window and a single bin per colour are enough
+    return _plan_acquisition(sample_rate, tuple(freqs), min_samples, max_samples)
+
+
+@functools.lru_cache(maxsize=1024)
+def _plan_acquisition(sample_rate, freqs, min_samples, max_samples):
+    # A tone is on a bin when samples * freq / sample_rate is an integer,
+    # so samples must be a multiple of the denominator of freq / sample_rate
+    # Float inputs are rounded to the nearest ratio that fits in max_samples
+    cycles = [(fractions.Fraction(freq) / fractions.Fraction(sample_rate)).limit_denominator(max_samples)
+              for freq in freqs]
+    step = math.lcm(*[c.denominator for c in cycles])
+    samples = step * math.ceil(min_samples / step)
+    if samples > max_samples:
+        raise ValueError("No coherent frame for {} Hz at {} Sa/s within {} samples".format(
+            list(freqs), sample_rate, max_samples))
+
+    bins = [int(c * samples) for c in cycles]
+    if len(set(bins)) != len(bins) or max(bins) >= samples // 2:
+        raise ValueError("Tones {} Hz do not fall on distinct bins below Nyquist".format(list(freqs)))
+
+    bin_arrays = []
+    for k in bins:
+        bin_array = np.array([k])
+        bin_array.flags.writeable = False
+        bin_arrays.append(bin_array)
+    return AcquisitionPlan(sample_rate, samples, tuple(bin_arrays))
+
+
 def light_transmittance(red_bins, green_bins, blue_bins, measured_data_fft, ref_data_fft):
     # Given the selected bins for Red , Green , Blue --> compute light transmittance
     # Compute Sample_Magnitude and Reference_Magnitude for each color
@@ -166,6 +325,225 @@ def light_transmittance(red_bins, green_bins, blue_bins, measured_data_fft, ref_
 
     return red_abs, green_abs, blue_abs
 
+
+def band_powers(bins_list, data_fft):
+    # Power (sum of squared magnitudes) of each group of bins, one value per colour
+    # light_transmittance is sqrt(sample power / reference power) * 100
+    # For many channels at once see band_power_matrix
+    return np.array([np.sum(np.abs(data_fft[bins]) ** 2.0) for bins in bins_list])
+
+
+class TransmittanceAverager:
+    # Streaming counterpart of light_transmittance, averaging over many frames
+    #
+    # Sample and reference band powers are summed per colour, so the average behaves like
+    # one longer frame. Modes:
+    #   'cumulative'   every frame since the start, or since reset()
+    #   'sliding'      the last window frames
+    #   'exponential'  older frames fade out with weight (1 - alpha) per frame
+    # Each update is O(1). Only the sliding mode keeps anything per frame: the band powers
+    # of the last window frames, needed to remove them again.
+    #
+    # The spread of the single frame transmittances gives the confidence interval of the average.
+
+    def __init__(self, colours=3, mode='cumulative', window=16, alpha=0.1):
+        if mode not in ('cumulative', 'sliding', 'exponential'):
+            raise ValueError("Unknown averaging mode: {}".format(mode))
+        self.colours = colours
+        self.mode = mode
+        self.window = window
+        self.alpha = alpha
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.sample_power = np.zeros(self.colours)
+        self.ref_power = np.zeros(self.colours)
+        # Statistics of the single frame transmittances
+        self.mean = np.zeros(self.colours)
+        self.m2 = np.zeros(self.colours)
+        if self.mode == 'sliding':
+            # sample power, reference power, transmittance of the frames in the window
+            self.history = np.zeros((self.window, 3, self.colours))
+            self.t_sum = np.zeros(self.colours)
+            self.t_sq_sum = np.zeros(self.colours)
+
+    def update(self, bins_list, measured_data_fft, ref_data_fft):
+        return self.update_powers(band_powers(bins_list, measured_data_fft), band_powers(bins_list, ref_data_fft))
+
+    def update_powers(self, sample_power, ref_power):
+        # Add one frame, returns the averaged transmittance
+        t = np.sqrt(sample_power / ref_power) * 100
+
+        if self.mode == 'cumulative':
+            self.count += 1
+            self.sample_power += sample_power
+            self.ref_power += ref_power
+            # Welford's running variance
+            delta = t - self.mean
+            self.mean += delta / self.count
+            self.m2 += delta * (t - self.mean)
+
+        elif self.mode == 'exponential':
+            if self.count == 0:
+                self.sample_power[:] = sample_power
+                self.ref_power[:] = ref_power
+                self.mean[:] = t
+            else:
+                a = self.alpha
+                self.sample_power += a * (sample_power - self.sample_power)
+                self.ref_power += a * (ref_power - self.ref_power)
+                delta = t - self.mean
+                self.mean += a * delta
+                self.m2 = (1 - a) * (self.m2 + a * delta ** 2)
+            self.count += 1
+
+        else:
+            slot = self.count % self.window
+            if self.count >= self.window:
+                old_sample, old_ref, old_t = self.history[slot]
+                self.sample_power -= old_sample
+                self.ref_power -= old_ref
+                self.t_sum -= old_t
+                self.t_sq_sum -= old_t ** 2
+            self.history[slot] = sample_power, ref_power, t
+            self.sample_power += sample_power
+            self.ref_power += ref_power
+            self.t_sum += t
+            self.t_sq_sum += t ** 2
+            self.count += 1
+            if slot == self.window - 1:
+                # Once per window, start the sums over to stop rounding errors from piling up
+                self.sample_power, self.ref_power, self.t_sum = self.history.sum(axis=0)
+                self.t_sq_sum = np.sum(self.history[:, 2] ** 2, axis=0)
+
+        return self.transmittance()
+
+    def transmittance(self):
+        return np.sqrt(self.sample_power / self.ref_power) * 100
+
+    def frames(self):
+        # Number of frames the average is worth
+        if self.mode == 'cumulative':
+            return self.count
+        if self.mode == 'sliding':
+            return min(self.count, self.window)
+        return min(self.count, (2 - self.alpha) / self.alpha)
+
+    def std(self):
+        # Standard deviation of the single frame transmittances
+        if self.mode == 'cumulative':
+            return np.sqrt(self.m2 / max(self.count - 1, 1))
+        if self.mode == 'sliding':
+            n = self.frames()
+            return np.sqrt(np.maximum(self.t_sq_sum - self.t_sum ** 2 / max(n, 1), 0) / max(n - 1, 1))
+        return np.sqrt(self.m2)
+
+    def confidence_interval(self, z=1.96):
+        # (low, high) around the averaged transmittance, 95% by default
+        half_width = z * self.std() / np.sqrt(max(self.frames(), 1))
+        centre = self.transmittance()
+        return centre - half_width, centre + half_width
+
+
+class _SparseDftCache:
+    # Windowed DFT matrices of sparse_fft, least recently used first out once they hold more than max_bytes
+    # A 65536 sample frame with 3 bins takes 3 MB, so a few frame sizes fit in the default 32 MB
+
+    def __init__(self, max_bytes=32 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+
+    def get(self, n, bins, window):
+        key = (n, bins, window)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            return entry
+
+        # Real rows: cos for the real parts, -sin for the imaginary parts, so real data never becomes complex
+        # Row sums let sparse_fft remove the DC offset after the product instead of copying the data
+        phase = 2 * np.pi * np.outer(bins, np.arange(n)) / n
+        matrix = fft_window(n, window) * np.vstack((np.cos(phase), -np.sin(phase)))
+        entry = (matrix.T.copy(), matrix.sum(axis=1))
+        for array in entry:
+            array.flags.writeable = False
+        self.entries[key] = entry
+        self.nbytes += sum(array.nbytes for array in entry)
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            old = self.entries.popitem(last=False)[1]
+            self.nbytes -= sum(array.nbytes for array in old)
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+
+_sparse_dft_cache = _SparseDftCache()
+
+
+def sparse_fft(data, bins, window='blackman'):
+    # Same values as compute_fft(data, window)[bins], without computing all the other bins
+    # The selected DFT bins are evaluated as one real matrix product, cos and sin rows together
+    # data is either one signal, or 2-D with one signal per row
+    data = np.asarray(data, dtype=float)
+    bins = tuple(int(b) for b in bins)
+    matrix, row_sums = _sparse_dft_cache.get(data.shape[-1], bins, window)
+    # (data - mean) @ matrix without the copy: subtract mean * column sums afterwards
+    products = data @ matrix
+    products -= np.mean(data, axis=-1, keepdims=True) * row_sums
+    return products[..., :len(bins)] + 1j * products[..., len(bins):]
+
+
+# Bins of every colour in one flat array, with the index where each colour starts
+# Lets band_power_matrix sum all colours of all channels with one np.add.reduceat
+BinTable = collections.namedtuple('BinTable', ['bins', 'starts'])
+
+
+def bin_table(bins_list):
+    # bins_list = one group of bins per colour, e.g. (red_bins, green_bins, blue_bins) or AcquisitionPlan.bins
+    groups = [np.atleast_1d(np.asarray(bins, dtype=int)) for bins in bins_list]
+    if any(len(group) == 0 for group in groups):
+        raise ValueError("Every colour needs at least one bin")
+    starts = np.cumsum([0] + [len(group) for group in groups[:-1]])
+    return BinTable(np.concatenate(groups), starts)
+
+
+def band_power_matrix(spectra, table):
+    # Band power of every colour in every row of spectra (channels, bins) -> (channels, colours)
+    # Same values as band_powers(bins_list, row) for each row
+    return np.add.reduceat(np.abs(spectra[..., table.bins]) ** 2.0, table.starts, axis=-1)
+
+
+def transmittance_matrix(frame, table, reference=0, channels=None, window='blackman'):
+    # Light transmittance of several sample channels against one shared reference channel
+    # frame = (channels, samples) from one acquisition, table = bin_table(...)
+    # channels = rows to measure, every row except the reference by default
+    # Returns (len(channels), colours), in %. Only the bins in the table are evaluated, see sparse_fft
+    frame = np.asarray(frame)
+    if channels is None:
+        channels = [row for row in range(len(frame)) if row != reference]
+    powers = band_power_matrix(sparse_fft(frame, table.bins, window), BinTable(np.arange(len(table.bins)),
+                                                                               table.starts))
+    return np.sqrt(powers[channels] / powers[reference]) * 100
+
+
+def light_transmittance_sparse(red_bins, green_bins, blue_bins, measured_data, ref_data, window='blackman'):
+    # Same result as light_transmittance(..., compute_fft(measured_data), compute_fft(ref_data))
+    # Only the selected bins are evaluated, for both channels in one pass
+    # Useful when the spectrum is not plotted
+    bins = list(red_bins) + list(green_bins) + list(blue_bins)
+    measured_bins_fft, ref_bins_fft = sparse_fft(np.vstack((measured_data, ref_data)), bins, window)
+
+    # Bin positions inside the reduced spectra
+    green_start = len(red_bins)
+    blue_start = green_start + len(green_bins)
+    return light_transmittance(range(0, green_start), range(green_start, blue_start),
+                               range(blue_start, len(bins)), measured_bins_fft, ref_bins_fft)
+
+
 def set_powersupply(ps):
     # enable and set power supply pins to +5, -5 V to power up OP Amp
     ps.reset()
@@ -0,0 +1,85 @@
+import numpy as np
+import colorimeter_functions
+
+# Streaming lock-in demodulation of the LED tones
+#
+# Every incoming sample of every channel is mixed with exp(-2j pi f n / fs) for each LED frequency,
+# and the products are summed over windows of `decimation` samples (integrate and dump, a boxcar
+# low-pass filter followed by decimation). Each full window gives one complex amplitude per channel
+# and colour; partial windows are carried over to the next chunk, so chunks can have any size as long
+# as they follow each other without a gap (see Backend.contiguous), otherwise use whole windows.
+#
+# The window length comes from plan_acquisition: every tone completes a whole number of periods in it,
+# so DC, the other LED tones and their harmonics cancel, as in the coherent FFT frame, except for
+# harmonics that alias onto an LED frequency (at 10 kSa/s the 15th harmonic of 700 Hz folds onto
+# 500 Hz), which add to that tone in both. Transmittance then matches light_transmittance on a frame
+# of `decimation` samples to rounding error, just available output_rate times per second instead of
+# once per long frame.
+
+
+class LockInDemodulator:
+
+    def __init__(self, sample_rate, freqs=colorimeter_functions.led_freqs, output_rate=100.0):
+        # output_rate = wanted results per second, rounded down to the nearest coherent window length
+        plan = colorimeter_functions.plan_acquisition(sample_rate, freqs,
+                                                      min_samples=max(1, int(sample_rate // output_rate)))
+        self.sample_rate = sample_rate
+        self.freqs = list(freqs)
+        self.decimation = plan.samples
+        self.output_rate = sample_rate / self.decimation
+        # (colours, 1) so one broadcast covers every tone of a chunk
+        self.cycles_per_sample = np.array([[freq / sample_rate] for freq in self.freqs])
+        self.reset()
+
+    def reset(self):
+        # Forget the partial window and restart the reference phase at sample 0
+        self.position = 0
+        self.partial = None
+        self.outputs = 0
+
+    def _mix(self, start, length):
+        # exp(-2j pi f n / fs) for n = start .. start + length - 1, shape (colours, length)
+        # The phase is reduced to one period in double precision, so it never drifts
+        cycles = self.cycles_per_sample * (start + np.arange(length))
+        cycles -= np.floor(cycles)
+        return np.exp(-2j * np.pi * cycles)
+
+    def process(self, chunk):
+        # chunk = (channels, samples) in acquisition order
+        # Returns the band powers of every window completed by this chunk, shape (windows, channels, colours),
+        # comparable with band_power_matrix on a frame of `decimation` samples
+        chunk = np.atleast_2d(chunk)
+        length = chunk.shape[1]
+        if self.partial is None:
+            self.partial = np.zeros((chunk.shape[0], len(self.freqs)), dtype=complex)
+        if length == 0:
+            return np.empty((0,) + self.partial.shape)
+
+        # Chunk indices where a window ends, then the segments between them
+        ends = np.arange(self.decimation - self.position % self.decimation, length + 1, self.decimation)
+        starts = np.concatenate(([0], ends[ends < length]))
+
+        # Mix all channels with all tones at once, (channels, 1, samples) x (colours, samples),
+        # then integrate each segment
+        products = chunk[:, np.newaxis, :] * self._mix(self.position, length)
+        sums = np.add.reduceat(products, starts, axis=-1)
+
+        completed = sums[:, :, :len(ends)]
+        if len(ends):
+            # The first segment finishes the window left open by the previous chunk
+            completed[:, :, 0] += self.partial
+            self.partial = np.zeros_like(self.partial)
+        if len(starts) > len(ends):
+            # Samples after the last boundary start the next window
+            self.partial += sums[:, :, -1]
+
+        self.position += length
+        self.outputs += len(ends)
+        return np.moveaxis(np.abs(completed) ** 2.0, -1, 0)
+
+    def transmittance(self, chunk, reference=0):
+        # Uncalibrated transmittance of every other channel against the reference row, for each window
+        # completed by chunk, shape (windows, channels - 1, colours), in %
+        powers = self.process(chunk)
+        samples = [row for row in range(powers.shape[1]) if row != reference]
+        return np.sqrt(powers[:, samples] / powers[:, reference:reference + 1]) * 100
@@ -0,0 +1,177 @@
+import collections
+import json
+import os
+import threading
+import time
+import numpy as np
+
+# Per-stage latency of the colorimeter loop
+#
+#   t = metrics.clock()
+#   ... acquire ...
+#   t = metrics.lap('acquire', t)
+#   ... fft ...
+#   metrics.lap('fft', t)
+#
+# Metrics keeps the last window durations of each stage, for p50/p95/p99, plus counters
+# (frames, drops) and gauges (backlog). fps is the frame rate since the previous snapshot. MetricsExporter writes them to a JSON or Prometheus
+# text file every few seconds. NULL_METRICS has the same methods doing nothing, it is what
+# the engine uses unless a Metrics is passed in.
+
+
+class Metrics:
+    enabled = True
+
+    def __init__(self, window=1024):
+        self.window = window
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.totals = collections.defaultdict(float)
+        self.counts = collections.Counter()
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.start_time = time.monotonic()
+        # (time, frames) at the previous snapshot, fps is measured from there
+        self.last_snapshot = (self.start_time, 0)
+
+    def clock(self):
+        return time.perf_counter()
+
+    def lap(self, stage, start):
+        # Records the time since start for stage and returns the current clock, to time the next stage
+        now = time.perf_counter()
+        self.record(stage, now - start)
+        return now
+
+    def record(self, stage, seconds):
+        with self.lock:
+            durations = self.durations.get(stage)
+            if durations is None:
+                durations = self.durations[stage] = collections.deque(maxlen=self.window)
+            durations.append(seconds)
+            self.totals[stage] += seconds
+            self.counts[stage] += 1
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def snapshot(self):
+        # Everything as plain numbers: stages in seconds, fps over the time since the previous snapshot,
+        # so a stall shows up in the next export however long the process has been running
+        now = time.monotonic()
+        with self.lock:
+            durations = {stage: np.array(values) for stage, values in self.durations.items()}
+            totals = dict(self.totals)
+            counts = dict(self.counts)
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            last_time, last_frames = self.last_snapshot
+            self.last_snapshot = (now, counters.get('frames', 0))
+        elapsed = max(now - self.start_time, 1e-9)
+        fps = (counters.get('frames', 0) - last_frames) / max(now - last_time, 1e-9)
+        stages = {}
+        for stage, values in durations.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stages[stage] = {'count': counts[stage], 'sum': totals[stage], 'p50': float(p50), 'p95': float(p95),
+                             'p99': float(p99), 'max': float(values.max())}
+        return {
+            'timestamp': time.time(),
+            'uptime': elapsed,
+            'fps': fps,
+            'stages': stages,
+            'counters': counters,
+            'gauges': gauges,
+        }
+
+
+class NullMetrics:
+    # Disabled metrics: every call returns at once and nothing is stored
+
+    enabled = False
+
+    def clock(self):
+        return 0.0
+
+    def lap(self, stage, start):
+        return 0.0
+
+    def record(self, stage, seconds):
+        pass
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, value):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def to_prometheus(snapshot, prefix='colorimeter'):
+    # Prometheus text exposition format: one summary for the stage latencies, counters and gauges
+    lines = ['# HELP {}_stage_seconds Latency of each stage of the colorimeter loop'.format(prefix),
+             '# TYPE {}_stage_seconds summary'.format(prefix)]
+    for stage, stats in sorted(snapshot['stages'].items()):
+        for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+            lines.append('{}_stage_seconds{{stage="{}",quantile="{}"}} {!r}'.format(prefix, stage, quantile,
+                                                                                   stats[key]))
+        lines.append('{}_stage_seconds_sum{{stage="{}"}} {!r}'.format(prefix, stage, stats['sum']))
+        lines.append('{}_stage_seconds_count{{stage="{}"}} {}'.format(prefix, stage, stats['count']))
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append('# TYPE {}_{}_total counter'.format(prefix, name))
+        lines.append('{}_{}_total {}'.format(prefix, name, value))
+    gauges = dict(snapshot['gauges'], fps=snapshot['fps'], uptime_seconds=snapshot['uptime'])
+    for name, value in sorted(gauges.items()):
+        lines.append('# TYPE {}_{} gauge'.format(prefix, name))
+        lines.append('{}_{} {!r}'.format(prefix, name, float(value)))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsExporter:
+    # Writes a Metrics snapshot to path every interval seconds, from a background thread, and once more on stop()
+    # fmt is 'json' or 'prometheus'. The file is replaced atomically, readers never see half of it.
+
+    def __init__(self, metrics, path, fmt='json', interval=5.0):
+        if fmt not in ('json', 'prometheus'):
+            raise ValueError("Unknown metrics format {}".format(fmt))
+        self.metrics = metrics
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def write(self):
+        snapshot = self.metrics.snapshot()
+        text = json.dumps(snapshot, indent=2) + '\n' if self.fmt == 'json' else to_prometheus(snapshot)
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as f:
+            f.write(text)
+        os.replace(temporary, self.path)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="colorimeter-metrics", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.write()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
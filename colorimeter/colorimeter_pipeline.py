@@ -0,0 +1,114 @@
+import collections
+import threading
+
+
+class ColorimeterPipeline:
+    # Runs acquisition, processing and rendering each at their own pace
+    #
+    # acquire() -> frame          called back to back by the producer thread
+    # process(frame) -> result    called by the processing thread, oldest frame first
+    # latest()                    polled by the renderer (usually the GUI thread) whenever it wants
+    #
+    # Frames wait in a bounded ring buffer. When the ring is full the oldest frame is dropped,
+    # so acquisition never waits for processing. The renderer only ever sees the newest result,
+    # results it never picked up are counted as skipped.
+
+    def __init__(self, acquire, process, ring_size=8):
+        self.acquire = acquire
+        self.process = process
+        self.ring = collections.deque(maxlen=ring_size)
+        self.condition = threading.Condition()
+        self.threads = []
+        self.running = False
+        self.error = None
+
+        self.result = None
+        self.result_count = 0
+        self.rendered_count = 0
+
+        self.frames_acquired = 0
+        self.frames_dropped = 0
+        self.frames_processed = 0
+        self.results_skipped = 0
+
+    def start(self):
+        self.running = True
+        self.threads = [threading.Thread(target=self._produce, name="colorimeter-acquire", daemon=True),
+                        threading.Thread(target=self._consume, name="colorimeter-process", daemon=True)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=1.0):
+        # A producer stuck in a blocking acquire() is left behind, it is a daemon thread
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _fail(self, error):
+        with self.condition:
+            self.error = error
+            self.running = False
+            self.condition.notify_all()
+
+    def _produce(self):
+        while self.running:
+            try:
+                frame = self.acquire()
+            except Exception as error:
+                self._fail(error)
+                return
+            with self.condition:
+                if len(self.ring) == self.ring.maxlen:
+                    self.frames_dropped += 1
+                self.ring.append(frame)
+                self.frames_acquired += 1
+                self.condition.notify()
+
+    def _consume(self):
+        while True:
+            with self.condition:
+                while self.running and not self.ring:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                frame = self.ring.popleft()
+            try:
+                result = self.process(frame)
+            except Exception as error:
+                self._fail(error)
+                return
+            with self.condition:
+                self.result = result
+                self.result_count += 1
+                self.frames_processed += 1
+
+    def latest(self):
+        # Newest result not returned yet, or None if there is nothing new
+        # Errors raised in the worker threads are re-raised here
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            if self.result_count == self.rendered_count:
+                return None
+            self.results_skipped += self.result_count - self.rendered_count - 1
+            self.rendered_count = self.result_count
+            return self.result
+
+    def stats(self):
+        with self.condition:
+            return {
+                'frames_acquired': self.frames_acquired,
+                'frames_dropped': self.frames_dropped,
+                'frames_processed': self.frames_processed,
+                'results_skipped': self.results_skipped,
+                'backlog': len(self.ring),
+            }
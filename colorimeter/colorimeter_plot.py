@@ -0,0 +1,110 @@
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+
+
+def decimate_peaks(data, width):
+    # Reduce data to at most width points by keeping the largest value of each group,
+    # one group per screen pixel column. Spectrum peaks keep their exact height
+    # Returns (x, y) with x the index of the first sample of each group
+    factor = max(1, int(np.ceil(len(data) / width)))
+    if factor == 1:
+        return np.arange(len(data)), data
+    starts = np.arange(0, len(data), factor)
+    return starts, np.maximum.reduceat(data, starts)
+
+
+class LivePlot:
+    # FFT and transmittance plots for the colorimeter scripts
+    # Artists are created once and redrawn with blitting, at most max_fps times per second,
+    # no matter how often update() is called
+
+    def __init__(self, n_bins, fft_ylim, colors=('red', 'green', 'blue'),
+                 bar_colors=('tab:red', 'tab:green', 'tab:blue'), max_fps=10):
+        self.fig, (self.ax1, self.ax2) = plt.subplots(nrows=2)
+        self.fig.set_figheight(6)
+        self.fig.set_figwidth(6)
+        self.min_interval = 1.0 / max_fps
+        self.last_draw = 0.0
+        self.pending = None
+        self.background = None
+
+        # Set-up FFT Plot
+        self.ax1.set_title("FFT Plot")
+        self.ax1.set_xlim(0, n_bins)
+        self.ax1.set_ylim([0, fft_ylim])
+        self.line1, = self.ax1.plot([], [], label="Reference Data", animated=True)
+        self.line2, = self.ax1.plot([], [], label="Sample Data", animated=True)
+        self.ax1.legend()
+
+        # Set-up transmittance plot
+        self.ax2.set_title("transmittance Plot")
+        self.ax2.set_ylim(0, 120)
+        self.bars = self.ax2.bar(colors, [0] * len(colors), color=bar_colors)
+        for bar in self.bars:
+            bar.set_animated(True)
+
+        # The background (axes, ticks, legend) is saved after every full redraw, e.g. on resize
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+        plt.show(block=False)
+        plt.pause(0.1)
+
+    def _on_draw(self, event):
+        if self.fig.canvas.supports_blit:
+            self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        self.ax1.draw_artist(self.line1)
+        self.ax1.draw_artist(self.line2)
+        for bar in self.bars:
+            self.ax2.draw_artist(bar)
+
+    def update(self, data_ref, data_sample, transmittance):
+        # Returns False when drawing is deferred to respect max_fps: the data is kept and drawn
+        # by the next update() or wait() once the interval has passed, so the newest values always show
+        self.pending = (data_ref, data_sample, transmittance)
+        return self._draw_pending()
+
+    def _draw_pending(self):
+        now = time.monotonic()
+        if self.pending is None or now - self.last_draw < self.min_interval:
+            return False
+        self.last_draw = now
+        data_ref, data_sample, transmittance = self.pending
+        self.pending = None
+
+        # No point in sending more than one point per pixel column to the screen
+        width = max(1, int(self.ax1.bbox.width))
+        self.line1.set_data(*decimate_peaks(data_ref, width))
+        self.line2.set_data(*decimate_peaks(data_sample, width))
+        for bar, height in zip(self.bars, transmittance):
+            bar.set_height(height)
+
+        canvas = self.fig.canvas
+        if self.background is None:
+            # First frame, or a backend without blitting: full redraw
+            canvas.draw_idle()
+        else:
+            canvas.restore_region(self.background)
+            self._draw_artists()
+            canvas.blit(self.fig.bbox)
+        canvas.flush_events()
+        return True
+
+    def wait(self, interval):
+        # Keep the window responsive for interval seconds, drawing deferred data as soon as max_fps allows
+        end = time.monotonic() + interval
+        while True:
+            now = time.monotonic()
+            if now >= end:
+                break
+            step = end - now
+            if self.pending is not None:
+                step = min(step, max(0.0, self.last_draw + self.min_interval - now))
+            if step > 0:
+                self.fig.canvas.start_event_loop(step)
+            self._draw_pending()
+
+    def is_open(self):
+        return plt.fignum_exists(self.fig.number)
@@ -1,7 +1,12 @@
-import genalyzer_advanced as gn
 import numpy as np
 import matplotlib.pyplot as pl
 from matplotlib.patches import Rectangle as MPRect
+import genalyzer_functions
+import genalyzer_plot
+
+# genalyzer_advanced when it is installed, the NumPy implementation otherwise
+# Set GENALYZER_BACKEND=genalyzer or numpy to choose
+gn = genalyzer_functions.import_genalyzer()
 
 # Configuration Params
 navg = 2  # No. of fft averages
@@ -13,6 +18,8 @@ fs = 1000  # Sampling frequency in Hz
 phase = 0.0  # Tone phase
 td = 0.0
 tj = 0.0
+synth_dtype = np.float64  # np.float32 halves the memory used by the waveform
+streaming = False  # True: generate, quantize and transform one nfft segment at a time, memory no longer grows with navg
 qres = 16  # Quantizer resolution
 qnoise_dbfs = -140.0  # Quantizer noise
 code_fmt = gn.CodeFormat.TWOS_COMPLEMENT  # ADC codes format
@@ -52,51 +59,66 @@ if gn.Window.NO_WINDOW == window:
     ssb_rest = 0
 
 # Now build up the signal from the fundamental, harmonics, and noise tones
-awf = np.zeros(npts)
-
+harm_freqs = []
 for harmonic in range(len(harm_dbfs)):
     freq = fund_freq * (harmonic + 1)
     print("Frequency: ", freq)
+    harm_freqs.append(freq)
 
-    awf += gn.cos(npts, fs, harm_ampl[harmonic], freq, phase, td, tj)
-
+noise_tone_freqs = []
 for tone in range(len(noise_freqs)):
     freq = noise_freqs[tone]
     if gn.Window.NO_WINDOW == window:
         freq = gn.coherent(nfft, fs, noise_freqs[tone])
     print("Noise Frequency: ", freq)
-    awf += gn.cos(npts, fs, noise_ampl[tone], freq, phase, td, tj)
+    noise_tone_freqs.append(freq)
+
+tones = genalyzer_functions.tone_table(harm_freqs + noise_tone_freqs, harm_ampl + noise_ampl, phase)
 
 # Get quantizer noise in Volts
 qnoise = 10 ** (qnoise_dbfs / 20)
 
-
-# Quantize waveform
-qwf = gn.quantize(np.array(awf), fsr, qres, qnoise, code_fmt)
+if streaming and td == 0.0 and tj == 0.0:
+    # One nfft segment at a time: synthesize, quantize and FFT it, then add its power to the average
+    # Only the start of the waveform is kept, for the plot below
+    awf_start = []
+
+    def keep_start(segment, awf):
+        if segment == 0:
+            awf_start.append(awf[:10000].copy())
+
+    fft_cplx = genalyzer_functions.streaming_rfft(tones, fs, nfft, navg, fsr, qres, qnoise, window, code_fmt,
+                                                  rfft_scale, dtype=synth_dtype, on_segment=keep_start,
+                                                  gn=gn)
+    awf = awf_start[0]
+else:
+    if td == 0.0 and tj == 0.0:
+        # All tones in one pass over a single buffer, the -200 dBFS ones are skipped
+        awf = genalyzer_functions.multitone(npts, fs, tones, dtype=synth_dtype)
+    else:
+        # Aperture delay and jitter need genalyzer's own generator
+        awf = np.zeros(npts, dtype=synth_dtype)
+        for tone in tones:
+            awf += gn.cos(npts, fs, tone.ampl, tone.freq, tone.phase, td, tj)
+
+    # Quantize waveform
+    # genalyzer works in double precision, a float32 waveform is converted here
+    qwf = gn.quantize(awf.astype(np.float64, copy=False), fsr, qres, qnoise, code_fmt)
+
+    # Compute FFT
+    fft_cplx = gn.rfft(np.array(qwf), qres, navg, nfft, window, code_fmt, rfft_scale)
 
 # Plot analog waveform
+# Plots show the min/max of each pixel column of the visible range, and are recomputed on zoom
 pl.figure(1)
-pl.plot(awf[:10000])
-
-# Compute FFT
-fft_cplx = gn.rfft(np.array(qwf), qres, navg, nfft, window, code_fmt, rfft_scale)
+awf_line = genalyzer_plot.plot_envelope(pl.gca(), np.arange(len(awf[:10000])), awf[:10000])
 # Compute frequency axis
 freq_axis = gn.freq_axis(nfft, gn.FreqAxisType.REAL, fs)
 # Compute FFT in db
 fft_db = gn.db(fft_cplx)
 
 # Fourier analysis configuration
-key = 'fa'
-gn.mgr_remove(key)
-gn.fa_create(key)
-gn.fa_analysis_band(key, "fdata*0.0", "fdata*1.0")
-gn.fa_fixed_tone(key, 'A', gn.FaCompTag.SIGNAL, fund_freq, ssb_fund)
-gn.fa_hd(key, 4)
-gn.fa_ssb(key, gn.FaSsb.DEFAULT, ssb_rest)
-gn.fa_ssb(key, gn.FaSsb.DC, -1)
-gn.fa_ssb(key, gn.FaSsb.SIGNAL, -1)
-gn.fa_ssb(key, gn.FaSsb.WO, -1)
-gn.fa_fsample(key, fs)
+key = genalyzer_functions.configure_fa(gn, 'fa', fund_freq, fs, ssb_fund, ssb_rest)
 print(gn.fa_preview(key, False))
 
 # Fourier analysis results
@@ -123,7 +145,7 @@ print("{:20s}{:20.6f}".format("thd", thd))
 pl.figure(2)
 fftax = pl.subplot2grid((1, 1), (0, 0), rowspan=2, colspan=2)
 pl.title("FFT")
-pl.plot(freq_axis, fft_db)
+fft_line = genalyzer_plot.plot_envelope(fftax, freq_axis, fft_db)
 pl.grid(True)
 pl.xlim(freq_axis[0], 20)
 pl.ylim(-160.0, 20.0)
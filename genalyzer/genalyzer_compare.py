@@ -0,0 +1,147 @@
+import argparse
+import sys
+import time
+import numpy as np
+import genalyzer_functions
+import genalyzer_numpy
+
+# Runs the genalyze_signal.py pipeline through genalyzer_advanced and genalyzer_numpy and reports
+# how far apart the results are and how long each stage takes
+#
+#   python genalyzer_compare.py
+#   python genalyzer_compare.py --nfft 65536 --navg 16 --window blackman_harris --tolerance 0.05
+#
+# Both backends analyze the same ADC codes, so quantizer noise does not count as a difference.
+# genalyzer_functions.streaming_rfft is also checked against the native navg average of each backend.
+# Exit code 1 if a result differs by more than --tolerance (dB for levels and ratios, bins for
+# frequencies, radians for phases).
+
+KEYS = ['A:freq', 'A:mag_dbfs', 'A:phase', '2A:freq', '2A:mag_dbfs', '2A:phase', '3A:freq', '3A:mag_dbfs',
+        '4A:freq', '4A:mag_dbfs', 'wo:freq', 'wo:mag_dbfs', 'snr', 'fsnr', 'thd_rss']
+
+
+def best_time(fn, repeat):
+    # (result, best wall time in s)
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def run_pipeline(gn, codes, args, fund_freq):
+    # rfft and fft_analysis of the given codes, returns (spectrum, results, {stage: seconds})
+    window = getattr(gn.Window, args.window.upper())
+    code_fmt = gn.CodeFormat.TWOS_COMPLEMENT
+    ssb_fund, ssb_rest = (0, 0) if args.window == 'no_window' else (4, 5)
+    timings = {}
+    fft_cplx, timings['rfft'] = best_time(
+        lambda: gn.rfft(codes, args.qres, args.navg, args.nfft, window, code_fmt, gn.RfftScale.DBFS_SIN), args.repeat)
+
+    key = genalyzer_functions.configure_fa(gn, 'compare', fund_freq, args.fs, ssb_fund, ssb_rest)
+    results, timings['fft_analysis'] = best_time(lambda: gn.fft_analysis(key, fft_cplx, args.nfft), args.repeat)
+    return np.asarray(fft_cplx), results, timings
+
+
+def streaming_error(gn, awf, tones, args):
+    # Largest dB difference between streaming_rfft and gn.rfft(..., navg, ...) on the same noiseless codes,
+    # over the bins above the quantization noise
+    window = getattr(gn.Window, args.window.upper())
+    code_fmt = gn.CodeFormat.TWOS_COMPLEMENT
+    codes = np.asarray(gn.quantize(awf, 2.0, args.qres, 0.0, code_fmt))
+    native = gn.rfft(codes, args.qres, args.navg, args.nfft, window, code_fmt, gn.RfftScale.DBFS_SIN)
+    streamed = genalyzer_functions.streaming_rfft(tones, args.fs, args.nfft, args.navg, 2.0, args.qres, 0.0, window,
+                                                  code_fmt, gn.RfftScale.DBFS_SIN, gn=gn)
+    db_native = gn.db(native)
+    db_streamed = gn.db(streamed)
+    visible = np.maximum(db_native, db_streamed) > -140
+    return float(np.max(np.abs(db_native - db_streamed)[visible])) if np.any(visible) else 0.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare genalyzer_numpy against genalyzer_advanced")
+    parser.add_argument('--nfft', type=int, default=1024 * 256)
+    parser.add_argument('--navg', type=int, default=2)
+    parser.add_argument('--fs', type=float, default=1000)
+    parser.add_argument('--qres', type=int, default=16)
+    parser.add_argument('--window', default='no_window', choices=['no_window', 'hann', 'blackman_harris'])
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage, the best one is reported")
+    parser.add_argument('--tolerance', type=float, default=0.01)
+    args = parser.parse_args(argv)
+
+    try:
+        gn = genalyzer_functions.import_genalyzer('genalyzer')
+    except ImportError:
+        print("genalyzer_advanced is not installed, nothing to compare against", file=sys.stderr)
+        return 1
+    npg = genalyzer_numpy
+
+    # Same signal as genalyze_signal.py
+    fund_freq = gn.coherent(args.nfft, args.fs, 1.0) if args.window == 'no_window' else 1.0
+    harm_dbfs = [-3.0, -23.0, -200.0, -200.0]
+    noise_freqs = [gn.coherent(args.nfft, args.fs, freq) for freq in [1.5, 2.5, 3.5, 4.5]]
+    noise_dbfs = [-200.0, -23.0, -200.0, -200.0]
+    tones = genalyzer_functions.tone_table([fund_freq * (h + 1) for h in range(len(harm_dbfs))] + noise_freqs,
+                                           genalyzer_functions.dbfs_to_ampl(harm_dbfs + noise_dbfs, 2.0))
+    awf = genalyzer_functions.multitone(args.navg * args.nfft, args.fs, tones)
+
+    print("{:24s}{:>16s}{:>16s}{:>12s}".format('', 'genalyzer', 'numpy', 'difference'))
+    failed = False
+
+    # Quantizers without noise must give the same codes
+    codes_gn, time_gn = best_time(lambda: np.asarray(gn.quantize(awf, 2.0, args.qres, 0.0,
+                                                                 gn.CodeFormat.TWOS_COMPLEMENT)), args.repeat)
+    codes_np, time_np = best_time(lambda: npg.quantize(awf, 2.0, args.qres, 0.0,
+                                                       npg.CodeFormat.TWOS_COMPLEMENT), args.repeat)
+    mismatched = int(np.count_nonzero(codes_gn != codes_np))
+    print("{:24s}{:>16s}{:>16s}{:>12d}".format('quantize codes differing', '', '', mismatched))
+    timings = {'quantize': (time_gn, time_np)}
+
+    spectrum_gn, results_gn, stages_gn = run_pipeline(gn, codes_gn, args, fund_freq)
+    spectrum_np, results_np, stages_np = run_pipeline(npg, codes_gn, args, fund_freq)
+    for stage in stages_gn:
+        timings[stage] = (stages_gn[stage], stages_np[stage])
+
+    # Spectra are compared in dB, on the bins that are above the quantization noise in either one
+    db_gn = gn.db(spectrum_gn)
+    db_np = npg.db(spectrum_np)
+    visible = np.maximum(db_gn, db_np) > -140
+    spectrum_error = float(np.max(np.abs(db_gn - db_np)[visible])) if np.any(visible) else 0.0
+    print("{:24s}{:>16s}{:>16s}{:>12.6f}".format('spectrum dB, max', '', '', spectrum_error))
+    failed |= spectrum_error > args.tolerance
+
+    # Segment by segment averaging must give the spectrum of the native average
+    streaming_gn = streaming_error(gn, awf, tones, args)
+    streaming_np = streaming_error(npg, awf, tones, args)
+    print("{:24s}{:16.6f}{:16.6f}{}".format('streaming vs navg dB', streaming_gn, streaming_np,
+                                             ' *' if max(streaming_gn, streaming_np) > args.tolerance else ''))
+    failed |= max(streaming_gn, streaming_np) > args.tolerance
+
+    fbin = args.fs / args.nfft
+    for key in KEYS:
+        old = results_gn.get(key)
+        new = results_np.get(key)
+        if old is None or new is None:
+            print("{:24s}{:>16s}{:>16s}".format(key, str(old), str(new)))
+            continue
+        if key.endswith(':freq'):
+            difference = abs(new - old) / fbin
+        elif key.endswith(':phase'):
+            difference = abs(np.angle(np.exp(1j * (new - old))))
+        elif key == 'thd_rss':
+            difference = abs(20 * np.log10(new / old)) if old > 0 and new > 0 else abs(new - old)
+        else:
+            difference = abs(new - old)
+        failed |= difference > args.tolerance
+        print("{:24s}{:16.6f}{:16.6f}{:12.6f}{}".format(key, old, new, difference,
+                                                         ' *' if difference > args.tolerance else ''))
+
+    print("\n{:24s}{:>16s}{:>16s}{:>12s}".format('time (s)', 'genalyzer', 'numpy', 'speedup'))
+    for stage, (time_gn, time_np) in timings.items():
+        print("{:24s}{:16.6f}{:16.6f}{:11.2f}x".format(stage, time_gn, time_np, time_gn / time_np))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
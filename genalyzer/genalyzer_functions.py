@@ -0,0 +1,141 @@
+import collections
+import os
+import numpy as np
+
+# Waveform helpers for genalyze_signal and the other genalyzer scripts
+# Only NumPy is needed here, genalyzer_advanced is imported by the functions that call it
+
+# One row of a tone table: frequency in Hz, amplitude in V (peak), phase in radians
+Tone = collections.namedtuple('Tone', ['freq', 'ampl', 'phase'])
+
+# Tones below this amplitude are left out of the synthesis, -180 dBFS for a 2 V full-scale range
+# They are far under the quantizer noise and would only cost a full pass over the buffer
+min_tone_ampl = 1e-9
+
+# Samples synthesized per pass, small enough that the per-chunk work arrays stay in cache
+synthesis_chunk = 8192
+
+# Analysis backends: 'genalyzer' is genalyzer_advanced, 'numpy' is genalyzer_numpy,
+# 'auto' is genalyzer_advanced when it is installed and genalyzer_numpy otherwise
+backends = ['auto', 'genalyzer', 'numpy']
+
+
+def import_genalyzer(backend=None):
+    # Returns the module to use as gn, backend defaults to the GENALYZER_BACKEND environment variable, then auto
+    backend = backend or os.environ.get('GENALYZER_BACKEND', 'auto')
+    if backend not in backends:
+        raise ValueError("Unknown genalyzer backend {}, expected one of {}".format(backend, backends))
+    if backend != 'numpy':
+        try:
+            import genalyzer_advanced
+            return genalyzer_advanced
+        except ImportError:
+            if backend == 'genalyzer':
+                raise
+    import genalyzer_numpy
+    return genalyzer_numpy
+
+
+def dbfs_to_ampl(dbfs, fsr):
+    # Peak amplitude of a sine wave at dbfs, for a converter with full-scale range fsr
+    return (fsr / 2) * 10 ** (np.asarray(dbfs, dtype=float) / 20)
+
+
+def tone_table(freqs, ampls, phases=0.0):
+    # Builds a list of Tone from parallel lists, phases may be a single value for all tones
+    phases = np.broadcast_to(phases, np.shape(freqs))
+    return [Tone(float(freq), float(ampl), float(phase)) for freq, ampl, phase in zip(freqs, ampls, phases)]
+
+
+def active_tones(tones, min_ampl=min_tone_ampl):
+    # The tones that actually contribute to the waveform
+    return [tone for tone in tones if abs(tone.ampl) >= min_ampl]
+
+
+def multitone(npts, fs, tones, start=0, dtype=np.float64, out=None, min_ampl=min_tone_ampl,
+              chunk=synthesis_chunk):
+    # Sum of ampl * cos(2 pi freq n / fs + phase) over all tones, for n = start .. start + npts - 1
+    # Same as adding gn.cos(npts, fs, ampl, freq, phase, 0, 0) for every tone, without jitter or delay,
+    # but written once into a single buffer. start lets a long waveform be generated piece by piece.
+    #
+    # dtype = np.float32 halves the buffer; phases are still computed in double precision
+    # out = existing buffer of npts samples to fill instead of allocating one
+    tones = active_tones(tones, min_ampl)
+    if out is None:
+        out = np.empty(npts, dtype=dtype)
+    elif len(out) != npts:
+        raise ValueError("out holds {} samples, expected {}".format(len(out), npts))
+    if not tones:
+        out[:] = 0
+        return out
+
+    # (tones, 1) columns, so one broadcast covers every tone of a chunk
+    cycles_per_sample = np.array([[tone.freq / fs] for tone in tones])
+    phases = np.array([[tone.phase] for tone in tones])
+    ampls = np.array([tone.ampl for tone in tones])
+
+    chunk = min(chunk, npts)
+    index = np.arange(chunk, dtype=np.float64)
+    cycles = np.empty((len(tones), chunk))
+    whole = np.empty((len(tones), chunk))
+    for offset in range(0, npts, chunk):
+        length = min(chunk, npts - offset)
+        np.multiply(cycles_per_sample, index[:length] + (start + offset), out=cycles[:, :length])
+        # Keep only the fraction of a period, the phase stays exact however long the waveform is
+        np.modf(cycles[:, :length], out=(cycles[:, :length], whole[:, :length]))
+        cycles[:, :length] *= 2 * np.pi
+        cycles[:, :length] += phases
+        np.cos(cycles[:, :length], out=cycles[:, :length])
+        # Weighted sum over the tones, straight into the output chunk
+        out[offset:offset + length] = ampls @ cycles[:, :length]
+    return out
+
+
+def configure_fa(gn, key, fund_freq, fs, ssb_fund=4, ssb_rest=5, harmonics=4):
+    # Fourier analysis configuration of genalyze_signal.py, stored under key in the genalyzer manager
+    # Any earlier configuration with the same key is replaced. Returns key, for gn.fft_analysis(key, ...)
+    # ssb_fund = side bins of the fundamental 'A', ssb_rest = side bins of the other components,
+    # both 0 for a coherent frame without window
+    gn.mgr_remove(key)
+    gn.fa_create(key)
+    gn.fa_analysis_band(key, "fdata*0.0", "fdata*1.0")
+    gn.fa_fixed_tone(key, 'A', gn.FaCompTag.SIGNAL, fund_freq, ssb_fund)
+    gn.fa_hd(key, harmonics)
+    gn.fa_ssb(key, gn.FaSsb.DEFAULT, ssb_rest)
+    gn.fa_ssb(key, gn.FaSsb.DC, -1)
+    gn.fa_ssb(key, gn.FaSsb.SIGNAL, -1)
+    gn.fa_ssb(key, gn.FaSsb.WO, -1)
+    gn.fa_fsample(key, fs)
+    return key
+
+
+def streaming_rfft(tones, fs, nfft, navg, fsr, qres, qnoise, window, code_fmt, rfft_scale, dtype=np.float64,
+                   on_segment=None, gn=None):
+    # Streaming counterpart of gn.rfft(gn.quantize(multitone(navg * nfft, ...)), qres, navg, nfft, ...): the
+    # waveform is generated, quantized and transformed one nfft segment at a time, so memory stays
+    # O(nfft) however large navg is
+    #
+    # The segment powers are averaged as they come. The result has the RMS averaged magnitude and the
+    # phase of the first segment, and can go straight to gn.fft_analysis and gn.db. It only equals the
+    # native navg average if the backend averages the same way, genalyzer_compare.py checks that.
+    # on_segment(index, awf) is called with each analog segment, e.g. to keep the start for a plot.
+    # gn is the genalyzer module to use, import_genalyzer() by default
+    if gn is None:
+        gn = import_genalyzer()
+
+    awf = np.empty(nfft, dtype=dtype)
+    power = None
+    for segment in range(navg):
+        multitone(nfft, fs, tones, start=segment * nfft, out=awf)
+        if on_segment is not None:
+            on_segment(segment, awf)
+        qwf = gn.quantize(awf.astype(np.float64, copy=False), fsr, qres, qnoise, code_fmt)
+        fft_cplx = np.asarray(gn.rfft(np.asarray(qwf), qres, 1, nfft, window, code_fmt, rfft_scale))
+        del qwf
+        if power is None:
+            power = np.abs(fft_cplx) ** 2
+            phase = np.angle(fft_cplx)
+        else:
+            power += np.abs(fft_cplx) ** 2
+    power /= navg
+    return np.sqrt(power) * np.exp(1j * phase)
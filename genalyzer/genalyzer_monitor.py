@@ -0,0 +1,239 @@
+import argparse
+import collections
+import json
+import sys
+import time
+import numpy as np
+import genalyzer_functions
+
+# Continuous SNR/THD monitor: the Fourier analysis is configured once, then every frame read from
+# the ADC is analyzed and printed as one JSON line, with acquisition and analysis latency
+#
+#   python genalyzer_monitor.py --source ad4630 --uri ip:192.168.10.2 --fund-freq 1000 --qres 16
+#   python genalyzer_monitor.py --source sim --frames 200 --report 1
+#
+# Latency statistics over the last --stats-window frames go to stderr every --report seconds.
+
+
+class AnalysisSession:
+    # Everything that does not change from frame to frame: the genalyzer analysis configuration
+    # and the settings passed to rfft. analyze(codes) runs one frame.
+
+    _count = 0
+
+    def __init__(self, nfft, fs, fund_freq, qres, window='blackman_harris', harmonics=4,
+                 code_fmt='twos_complement', gn=None):
+        self.gn = gn or genalyzer_functions.import_genalyzer()
+        gn = self.gn
+        self.nfft = nfft
+        self.fs = fs
+        self.qres = qres
+        self.harmonics = harmonics
+        self.window = getattr(gn.Window, window.upper())
+        self.code_fmt = getattr(gn.CodeFormat, code_fmt.upper())
+
+        # Same tone and side bin settings as genalyze_signal.py
+        ssb_fund, ssb_rest = 4, 5
+        if gn.Window.NO_WINDOW == self.window:
+            fund_freq = gn.coherent(nfft, fs, fund_freq)
+            ssb_fund, ssb_rest = 0, 0
+        self.fund_freq = fund_freq
+
+        AnalysisSession._count += 1
+        self.key = genalyzer_functions.configure_fa(gn, 'monitor_{}'.format(AnalysisSession._count), fund_freq, fs,
+                                                    ssb_fund, ssb_rest, harmonics)
+
+        self.fields = ['snr', 'fsnr', 'thd', 'A:freq', 'A:mag_dbfs']
+        self.fields += ['{}A:mag_dbfs'.format(harmonic) for harmonic in range(2, harmonics + 1)]
+        self.fields += ['wo:freq', 'wo:mag_dbfs']
+
+    def spectrum(self, codes):
+        return self.gn.rfft(codes, self.qres, 1, self.nfft, self.window, self.code_fmt, self.gn.RfftScale.DBFS_SIN)
+
+    def analyze(self, codes):
+        # Returns a dict with the fields listed in self.fields, thd in dB relative to the fundamental
+        results = self.gn.fft_analysis(self.key, self.spectrum(codes), self.nfft)
+        metrics = {}
+        for field in self.fields:
+            if field == 'thd':
+                fundamental = 10 ** (results['A:mag_dbfs'] / 20)
+                metrics[field] = 20 * np.log10(results['thd_rss'] / fundamental) \
+                    if results['thd_rss'] > 0 else float('-inf')
+            else:
+                metrics[field] = float(results.get(field, np.nan))
+        return metrics
+
+    def close(self):
+        self.gn.mgr_remove(self.key)
+
+
+class AD4630Source:
+    # Frames of nfft ADC codes from one AD4630 channel, through pyadi-iio as in platinum_colorimeter.py
+
+    def __init__(self, nfft, uri="ip:192.168.10.2", device_name="ad4630-16", sample_rate=10000, channel=0):
+        import adi
+        self.adc = adi.ad4630(uri=uri, device_name=device_name)
+        self.adc.sample_rate = sample_rate
+        self.adc.rx_enabled_channels = [channel]
+        self.adc.rx_buffer_size = nfft
+        self.sample_rate = self.adc.sample_rate
+
+    def read(self):
+        data = self.adc.rx()
+        # A single enabled channel may come back as one array or as a list of one
+        if isinstance(data, (list, tuple)):
+            data = data[0]
+        return np.asarray(data)
+
+    def close(self):
+        self.adc.rx_destroy_buffer()
+
+
+class SimulatedSource:
+    # Quantized multitone frames, continuous from one frame to the next, paced like the ADC if realtime
+
+    def __init__(self, nfft, sample_rate=10000, tones=None, qres=16, fsr=2.0, qnoise_dbfs=-140.0, realtime=True,
+                 seed=None):
+        self.nfft = nfft
+        self.sample_rate = sample_rate
+        if tones is None:
+            # Fundamental at -3 dBFS with a -60 dBc second harmonic
+            fund_freq = sample_rate / 10
+            tones = genalyzer_functions.tone_table([fund_freq, 2 * fund_freq],
+                                                   genalyzer_functions.dbfs_to_ampl([-3.0, -63.0], fsr))
+        self.tones = tones
+        self.qres = qres
+        self.fsr = fsr
+        self.lsb = fsr / 2 ** qres
+        self.qnoise = 10 ** (qnoise_dbfs / 20)
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.awf = np.empty(nfft)
+        self.position = 0
+        self.next_time = time.monotonic()
+
+    def read(self):
+        if self.realtime:
+            self.next_time += self.nfft / self.sample_rate
+            delay = self.next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        genalyzer_functions.multitone(self.nfft, self.sample_rate, self.tones, start=self.position, out=self.awf)
+        self.position += self.nfft
+        self.awf += self.rng.normal(0.0, self.qnoise, self.nfft)
+        codes = np.floor(self.awf / self.lsb + 0.5)
+        np.clip(codes, -2 ** (self.qres - 1), 2 ** (self.qres - 1) - 1, out=codes)
+        return codes.astype(np.int32)
+
+    def close(self):
+        pass
+
+
+class LatencyStats:
+    # Rolling latency statistics, in ms, over the last window frames of each stage
+
+    def __init__(self, window=256):
+        self.samples = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self.frames = 0
+        self.start = time.monotonic()
+
+    def add(self, stage, seconds):
+        self.samples[stage].append(seconds * 1000)
+
+    def summary(self):
+        summary = {'frames': self.frames, 'fps': self.frames / max(time.monotonic() - self.start, 1e-9)}
+        for stage, values in self.samples.items():
+            values = np.array(values)
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            summary[stage] = {'mean': float(values.mean()), 'p50': float(p50), 'p95': float(p95),
+                              'p99': float(p99), 'max': float(values.max())}
+        return summary
+
+
+def monitor(source, session, frames=None, duration=None, stats=None, on_frame=None, report=None,
+            on_report=None):
+    # Reads and analyzes frames until frames or duration is reached, or forever
+    # on_frame(frame, metrics) gets each result, on_report(summary) runs every report seconds
+    # Returns the final latency summary
+    stats = stats or LatencyStats()
+    start = time.monotonic()
+    last_report = start
+    frame = 0
+    while frames is None or frame < frames:
+        if duration is not None and time.monotonic() - start >= duration:
+            break
+        t0 = time.perf_counter()
+        codes = source.read()
+        t1 = time.perf_counter()
+        metrics = session.analyze(codes)
+        t2 = time.perf_counter()
+        stats.add('acquire_ms', t1 - t0)
+        stats.add('analysis_ms', t2 - t1)
+        stats.frames += 1
+        metrics['acquire_ms'] = (t1 - t0) * 1000
+        metrics['analysis_ms'] = (t2 - t1) * 1000
+        if on_frame is not None:
+            on_frame(frame, metrics)
+        frame += 1
+        if report is not None and on_report is not None and time.monotonic() - last_report >= report:
+            last_report = time.monotonic()
+            on_report(stats.summary())
+    return stats.summary()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Continuous SNR/THD monitor, one JSON line per frame")
+    parser.add_argument('--source', choices=['ad4630', 'sim'], default='ad4630')
+    parser.add_argument('--uri', default="ip:192.168.10.2")
+    parser.add_argument('--device-name', default="ad4630-16")
+    parser.add_argument('--channel', type=int, default=0)
+    parser.add_argument('--sample-rate', type=int, default=10000, help="ADC sample rate in Sa/s")
+    parser.add_argument('--nfft', type=int, default=4096, help="samples per frame")
+    parser.add_argument('--qres', type=int, default=16, help="ADC resolution in bits")
+    parser.add_argument('--fund-freq', type=float, help="expected fundamental in Hz (default: sample rate / 10)")
+    parser.add_argument('--harmonics', type=int, default=4)
+    parser.add_argument('--window', default='blackman_harris', choices=['no_window', 'hann', 'blackman_harris'])
+    parser.add_argument('--backend', choices=genalyzer_functions.backends, help="genalyzer implementation")
+    parser.add_argument('--fast', action='store_true', help="sim: do not pace frames in real time")
+    parser.add_argument('--seed', type=int, help="sim: random seed")
+    parser.add_argument('--frames', type=int, help="stop after this many frames")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    parser.add_argument('--report', type=float, default=5.0, help="seconds between latency reports on stderr")
+    parser.add_argument('--stats-window', type=int, default=256, help="frames in the latency statistics")
+    args = parser.parse_args(argv)
+
+    fund_freq = args.fund_freq or args.sample_rate / 10
+    gn = genalyzer_functions.import_genalyzer(args.backend)
+    source = None
+    sample_rate = args.sample_rate
+    if args.source == 'ad4630':
+        source = AD4630Source(args.nfft, args.uri, args.device_name, args.sample_rate, args.channel)
+        sample_rate = source.sample_rate
+    session = AnalysisSession(args.nfft, sample_rate, fund_freq, args.qres, args.window, args.harmonics, gn=gn)
+    if source is None:
+        # The simulated tone sits where the analysis expects it, on a bin when there is no window
+        tones = genalyzer_functions.tone_table([session.fund_freq, 2 * session.fund_freq],
+                                               genalyzer_functions.dbfs_to_ampl([-3.0, -63.0], 2.0))
+        source = SimulatedSource(args.nfft, sample_rate, tones, args.qres, realtime=not args.fast, seed=args.seed)
+
+    def print_frame(frame, metrics):
+        sys.stdout.write(json.dumps(dict(frame=frame, **metrics)) + '\n')
+        sys.stdout.flush()
+
+    def print_report(summary):
+        print(json.dumps(summary), file=sys.stderr)
+
+    try:
+        summary = monitor(source, session, args.frames, args.duration, LatencyStats(args.stats_window),
+                          print_frame, args.report, print_report)
+        print_report(summary)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        session.close()
+        source.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,339 @@
+import enum
+import functools
+import numpy as np
+import genalyzer_functions
+
+# Pure NumPy stand-in for the parts of genalyzer_advanced used by the genalyzer scripts
+# Same function names and arguments, so it can be imported as gn:
+#
+#   gn = genalyzer_functions.import_genalyzer('numpy')
+#
+# Covers cos, coherent, quantize, rfft, db, freq_axis, the fa_* configuration calls, fft_analysis
+# and fa_annotations. fft_analysis returns the keys the scripts read: <tone>:freq, <tone>:mag_dbfs,
+# <tone>:phase for A, 2A, 3A, ..., dc and wo, then snr, fsnr, sinad, sfdr, thd_rss and noise.
+# genalyzer_compare.py checks the results against the library.
+#
+# Spectra are scaled so a full-scale sine reads 0 dBFS, tone power is the sum of its bins.
+
+
+class CodeFormat(enum.IntEnum):
+    OFFSET_BINARY = 0
+    TWOS_COMPLEMENT = 1
+
+
+class RfftScale(enum.IntEnum):
+    DBFS_DC = 0
+    DBFS_SIN = 1
+    NATIVE = 2
+
+
+class Window(enum.IntEnum):
+    BLACKMAN_HARRIS = 0
+    HANN = 1
+    NO_WINDOW = 2
+
+
+class FreqAxisType(enum.IntEnum):
+    DC_CENTER = 0
+    DC_LEFT = 1
+    REAL = 2
+
+
+class FaCompTag(enum.IntEnum):
+    DC = 0
+    SIGNAL = 1
+    HD = 2
+    IMD = 3
+    NOISE = 4
+
+
+class FaSsb(enum.IntEnum):
+    DEFAULT = 0
+    DC = 1
+    SIGNAL = 2
+    WO = 3
+
+
+# Lowest value returned by db(), instead of -inf for empty bins
+db_floor = -300.0
+
+
+def cos(nsamples, fs, ampl, freq, phase, td, tj, seed=None):
+    # ampl * cos(2 pi freq (n / fs + td + jitter) + phase), jitter being Gaussian with tj seconds rms
+    if td == 0.0 and tj == 0.0:
+        return genalyzer_functions.multitone(nsamples, fs, [genalyzer_functions.Tone(freq, ampl, phase)],
+                                             min_ampl=0.0)
+    t = np.arange(nsamples) / fs + td
+    if tj:
+        t += np.random.default_rng(seed).normal(0.0, tj, nsamples)
+    return ampl * np.cos(2 * np.pi * freq * t + phase)
+
+
+def coherent(nfft, fs, freq):
+    # Frequency with a whole number of cycles in nfft samples: freq rounded down to a bin, at least one cycle
+    # For a power of two nfft an even cycle count is raised by one, so every sample lands on a different code
+    # The result can be below freq, e.g. 1.5 Hz at fs = 1000 and nfft = 262144 gives 1.4992 Hz
+    fbin = fs / nfft
+    cycles = max(np.floor(freq / fbin), 1.0)
+    if nfft & (nfft - 1) == 0 and cycles % 2 == 0:
+        cycles += 1
+    return cycles * fbin
+
+
+def quantize(in_array, fsr, qres, qnoise, code_fmt, seed=None):
+    # Ideal qres bit converter with fsr full-scale range, Gaussian noise of qnoise V rms added first
+    # Returns int32 codes
+    lsb = fsr / 2 ** qres
+    data = np.asarray(in_array, dtype=np.float64)
+    if qnoise:
+        data = data + np.random.default_rng(seed).normal(0.0, qnoise, len(data))
+    codes = np.floor(data / lsb + 0.5)
+    np.clip(codes, -2 ** (qres - 1), 2 ** (qres - 1) - 1, out=codes)
+    codes = codes.astype(np.int32)
+    if code_fmt == CodeFormat.OFFSET_BINARY:
+        codes += 2 ** (qres - 1)
+    return codes
+
+
+@functools.lru_cache(maxsize=16)
+def _window(window, n):
+    # Computed once per size, read-only so callers cannot change the cached array
+    k = np.arange(n) * (2 * np.pi / n)
+    if window == Window.HANN:
+        w = 0.5 - 0.5 * np.cos(k)
+    elif window == Window.BLACKMAN_HARRIS:
+        w = 0.35875 - 0.48829 * np.cos(k) + 0.14128 * np.cos(2 * k) - 0.01168 * np.cos(3 * k)
+    else:
+        return None
+    w.flags.writeable = False
+    return w
+
+
+def rfft(in_array, qres, navg, nfft, window, code_fmt, scale):
+    # Spectrum of navg consecutive nfft segments of ADC codes, nfft // 2 + 1 complex bins
+    # With navg > 1 the magnitude is the RMS average and the phase that of the first segment
+    codes = np.asarray(in_array)
+    if len(codes) < navg * nfft:
+        raise ValueError("rfft needs navg * nfft = {} samples, got {}".format(navg * nfft, len(codes)))
+    segments = codes[:navg * nfft].reshape(navg, nfft).astype(np.float64)
+    if code_fmt == CodeFormat.OFFSET_BINARY:
+        segments -= 2 ** (qres - 1)
+    segments /= 2 ** (qres - 1)
+
+    w = _window(window, nfft)
+    if w is not None:
+        segments *= w
+    spectra = np.fft.rfft(segments, axis=-1)
+
+    if scale != RfftScale.NATIVE:
+        # Energy normalized: the bins of a full-scale sine add up to 1, windowed or not
+        sum_w2 = nfft if w is None else np.sum(w ** 2)
+        spectra *= 2 / np.sqrt(nfft * sum_w2)
+        if scale == RfftScale.DBFS_DC:
+            spectra /= 2
+    if navg == 1:
+        return spectra[0]
+    magnitude = np.sqrt(np.mean(np.abs(spectra) ** 2, axis=0))
+    return magnitude * np.exp(1j * np.angle(spectra[0]))
+
+
+def db(fft_data):
+    # 10 log10 of the magnitude squared of each bin
+    msq = np.abs(np.asarray(fft_data)) ** 2
+    with np.errstate(divide='ignore'):
+        return np.maximum(10 * np.log10(msq), db_floor)
+
+
+def freq_axis(nfft, axis_type, fs):
+    if axis_type == FreqAxisType.REAL:
+        return np.arange(nfft // 2 + 1) * (fs / nfft)
+    axis = np.arange(nfft) * (fs / nfft)
+    if axis_type == FreqAxisType.DC_CENTER:
+        axis -= (nfft // 2) * (fs / nfft)
+    return axis
+
+
+# Fourier analysis configurations, by key, as dicts
+_configs = {}
+
+
+def mgr_remove(key):
+    _configs.pop(key, None)
+
+
+def fa_create(key):
+    _configs[key] = {
+        'band': ("fdata*0.0", "fdata*1.0"),
+        'tones': [],
+        'hd': 3,
+        'ssb': {FaSsb.DEFAULT: 0, FaSsb.DC: -1, FaSsb.SIGNAL: -1, FaSsb.WO: -1},
+        'fsample': 1.0,
+    }
+
+
+def fa_analysis_band(key, center, width):
+    # Expressions of fdata, e.g. "fdata*0.0", "fdata*1.0" for the whole band
+    _configs[key]['band'] = (center, width)
+
+
+def fa_fixed_tone(key, name, tag, freq, ssb):
+    _configs[key]['tones'].append((name, tag, freq, ssb))
+
+
+def fa_hd(key, order):
+    _configs[key]['hd'] = order
+
+
+def fa_ssb(key, group, ssb):
+    _configs[key]['ssb'][group] = ssb
+
+
+def fa_fsample(key, fs):
+    _configs[key]['fsample'] = fs
+
+
+def fa_preview(key, cplx):
+    config = _configs[key]
+    lines = ["Fourier analysis '{}' (numpy backend)".format(key),
+             "  fsample: {}".format(config['fsample']),
+             "  band: center {}, width {}".format(*config['band'])]
+    for name, tag, freq, ssb in config['tones']:
+        lines.append("  tone {}: {} Hz, ssb {}".format(name, freq, ssb))
+    lines.append("  harmonics: {}".format(config['hd']))
+    lines.append("  ssb: " + ", ".join("{} {}".format(group.name, ssb) for group, ssb in config['ssb'].items()))
+    return "\n".join(lines)
+
+
+def _eval_band(expression, fdata):
+    # Only products like fdata*0.5 or plain numbers are expected here
+    text = str(expression).replace(' ', '')
+    if text.startswith('fdata*'):
+        return fdata * float(text[len('fdata*'):])
+    if text == 'fdata':
+        return fdata
+    return float(text)
+
+
+def _ssb(config, group):
+    ssb = config['ssb'][group]
+    return config['ssb'][FaSsb.DEFAULT] if ssb < 0 else ssb
+
+
+def _alias_bin(freq, fs, nfft):
+    # Bin of freq folded into the first Nyquist zone
+    freq = np.mod(freq, fs)
+    if freq > fs / 2:
+        freq = fs - freq
+    return int(round(freq / fs * nfft))
+
+
+def fft_analysis(key, fft_data, nfft):
+    # fft_data = rfft output, or its magnitude squared as a real array
+    config = _configs[key]
+    fs = config['fsample']
+    fft_data = np.asarray(fft_data)
+    if np.iscomplexobj(fft_data):
+        msq = np.abs(fft_data) ** 2
+        phases = np.angle(fft_data)
+    else:
+        msq = fft_data.astype(np.float64)
+        phases = np.zeros(len(msq))
+    nbins = len(msq)
+    fbin = fs / nfft
+
+    center = _eval_band(config['band'][0], fs)
+    width = _eval_band(config['band'][1], fs)
+    freqs = np.arange(nbins) * fbin
+    in_band = np.abs(freqs - center) <= width / 2 + fbin / 2
+    used = np.zeros(nbins, dtype=bool)
+    results = {'fsample': fs, 'fdata': fs, 'fbin': fbin, 'nfft': nfft}
+
+    def add_component(name, center_bin, ssb):
+        first = max(center_bin - ssb, 0)
+        last = min(center_bin + ssb, nbins - 1)
+        bins = np.arange(first, last + 1)
+        bins = bins[~used[bins]]
+        used[bins] = True
+        power = np.sum(msq[bins])
+        results[name + ':freq'] = center_bin * fbin
+        results[name + ':ffinal'] = center_bin * fbin
+        results[name + ':mag'] = np.sqrt(power)
+        results[name + ':mag_dbfs'] = 10 * np.log10(power) if power > 0 else db_floor
+        results[name + ':phase'] = phases[center_bin]
+        results[name + ':nbins'] = len(bins)
+        return power
+
+    add_component('dc', 0, _ssb(config, FaSsb.DC))
+    signal_power = 0.0
+    signal_dbfs = db_floor
+    fundamental = None
+    for name, tag, freq, ssb in config['tones']:
+        power = add_component(name, _alias_bin(freq, fs, nfft), _ssb(config, FaSsb.SIGNAL) if ssb < 0 else ssb)
+        if tag == FaCompTag.SIGNAL:
+            signal_power += power
+            if fundamental is None:
+                fundamental = (name, freq)
+    signal_dbfs = 10 * np.log10(signal_power) if signal_power > 0 else db_floor
+
+    # Harmonics of the first signal tone, folded into the first Nyquist zone
+    distortion_power = 0.0
+    if fundamental is not None:
+        name, freq = fundamental
+        for harmonic in range(2, config['hd'] + 1):
+            distortion_power += add_component('{}{}'.format(harmonic, name), _alias_bin(freq * harmonic, fs, nfft),
+                                              _ssb(config, FaSsb.DEFAULT))
+
+    # Everything else in the band is noise, the worst other bin included
+    noise_bins = in_band & ~used
+    noise_power = np.sum(msq[noise_bins])
+    if np.any(noise_bins):
+        worst = int(np.argmax(np.where(noise_bins, msq, -1.0)))
+        ssb = _ssb(config, FaSsb.WO)
+        first = max(worst - ssb, 0)
+        last = min(worst + ssb, nbins - 1)
+        wo_power = np.sum(msq[first:last + 1][noise_bins[first:last + 1]])
+        results['wo:freq'] = worst * fbin
+        results['wo:ffinal'] = worst * fbin
+        results['wo:mag'] = np.sqrt(wo_power)
+        results['wo:mag_dbfs'] = 10 * np.log10(wo_power) if wo_power > 0 else db_floor
+        results['wo:phase'] = phases[worst]
+        results['wo:nbins'] = last - first + 1
+
+    def ratio_db(numerator, denominator):
+        if numerator <= 0:
+            return db_floor
+        if denominator <= 0:
+            return -db_floor
+        return 10 * np.log10(numerator / denominator)
+
+    results['noise'] = np.sqrt(noise_power)
+    results['thd_rss'] = np.sqrt(distortion_power)
+    results['snr'] = ratio_db(signal_power, noise_power)
+    results['fsnr'] = ratio_db(1.0, noise_power)
+    results['sinad'] = ratio_db(signal_power, noise_power + distortion_power)
+    components = _components(results)
+    spurs = [results[name + ':mag_dbfs'] for name in components if name not in ('dc', fundamental and fundamental[0])]
+    results['sfdr'] = signal_dbfs - max(spurs) if spurs else -db_floor
+    for name in components:
+        results[name + ':mag_dbc'] = results[name + ':mag_dbfs'] - signal_dbfs
+    return results
+
+
+def _components(results):
+    # Component names in the order fft_analysis found them, every component has a name:nbins key
+    return [key[:-len(':nbins')] for key in results if key.endswith(':nbins')]
+
+
+def fa_annotations(results, floor=db_floor):
+    # labels: (freq, mag_dbfs, name) of each component
+    # tone_boxes: (left, bottom, width, height) over the bins of each component, from floor up to its level
+    labels = []
+    tone_boxes = []
+    fbin = results['fbin']
+    for name in _components(results):
+        freq = results[name + ':freq']
+        mag = results[name + ':mag_dbfs']
+        labels.append((freq, mag, name))
+        width = results[name + ':nbins'] * fbin
+        tone_boxes.append((freq - width / 2, floor, width, mag - floor))
+    return {'labels': labels, 'tone_boxes': tone_boxes}
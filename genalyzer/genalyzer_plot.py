@@ -0,0 +1,63 @@
+import numpy as np
+
+# Plotting helpers for large spectra and waveforms
+# Only the visible part of the data is drawn, reduced to the minimum and maximum of each pixel
+# column, and recomputed whenever the x range or the figure size changes
+
+
+def visible_range(x, xmin, xmax):
+    # Slice of sorted x covering [xmin, xmax], plus one point on each side so lines reach the edges
+    start = max(int(np.searchsorted(x, xmin, side='left')) - 1, 0)
+    stop = min(int(np.searchsorted(x, xmax, side='right')) + 1, len(x))
+    return slice(start, stop)
+
+
+def minmax_envelope(x, y, width):
+    # Reduces (x, y) to at most 2 * width points: the minimum and the maximum of each of width groups,
+    # in their original order and at their original x, so peaks and notches keep their exact value
+    n = len(y)
+    if n <= 2 * width:
+        return x, y
+    group = -(-n // width)
+    groups = -(-n // group)
+    # The last group is padded with its own last value, which changes neither its minimum nor maximum
+    padded = np.pad(y, (0, groups * group - n), mode='edge').reshape(groups, group)
+    starts = np.arange(groups) * group
+    lows = np.minimum(starts + padded.argmin(axis=1), n - 1)
+    highs = np.minimum(starts + padded.argmax(axis=1), n - 1)
+    index = np.sort(np.stack([lows, highs], axis=1), axis=1).ravel()
+    return x[index], y[index]
+
+
+class EnvelopeLine:
+    # A Line2D showing the min/max envelope of (x, y) for the current view of ax
+    # Keep a reference to it: matplotlib only holds weak references to the callbacks
+
+    def __init__(self, ax, x, y, **kwargs):
+        self.ax = ax
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.line, = ax.plot([], [], **kwargs)
+        # Full data limits for autoscaling, the line itself only holds what is visible
+        ax.update_datalim(np.column_stack([self.x[[0, -1]], [np.min(self.y), np.max(self.y)]]))
+        ax.autoscale_view()
+        self.xlim_cid = ax.callbacks.connect('xlim_changed', self.update)
+        self.resize_cid = ax.figure.canvas.mpl_connect('resize_event', self.update)
+        self.update()
+
+    def update(self, *args):
+        xmin, xmax = sorted(self.ax.get_xlim())
+        view = visible_range(self.x, xmin, xmax)
+        width = max(int(self.ax.bbox.width), 1)
+        self.line.set_data(*minmax_envelope(self.x[view], self.y[view], width))
+        self.ax.figure.canvas.draw_idle()
+
+    def remove(self):
+        self.ax.callbacks.disconnect(self.xlim_cid)
+        self.ax.figure.canvas.mpl_disconnect(self.resize_cid)
+        self.line.remove()
+
+
+def plot_envelope(ax, x, y, **kwargs):
+    # Drop-in for ax.plot(x, y, **kwargs) with sorted x, returns the EnvelopeLine
+    return EnvelopeLine(ax, x, y, **kwargs)
@@ -0,0 +1,243 @@
+import argparse
+import ast
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+import time
+import numpy as np
+import genalyzer_functions
+
+# Runs the genalyze_signal.py pipeline (synthesize -> quantize -> rfft -> fft_analysis) for many
+# configurations across a process pool, and collects the results in one columnar table
+#
+#   python genalyzer_sweep.py --grid qres=12,14,16 --grid "harm_dbfs[1]=-20,-40,-60" --output sweep.npz
+#   python genalyzer_sweep.py --set navg=16 --grid window=no_window,blackman_harris --grid qnoise_dbfs=-140,-120
+#   python genalyzer_sweep.py --configs points.json --workers 8
+#   python genalyzer_sweep.py --set backend=numpy --grid qres=8,10,12,14,16
+#   python genalyzer_sweep.py --set streaming=True --set navg=64 --grid qres=12,16 --workers 8
+#
+# Keys are the names used in genalyze_signal.py. A single element of a list is addressed as name[i].
+# The table holds one row per configuration: every swept value, then snr, fsnr, thd and the
+# frequency, magnitude and phase of each harmonic, e.g. 2A:mag_dbfs.
+
+DEFAULTS = {
+    'navg': 2,  # No. of fft averages
+    'nfft': 1024 * 256,  # FFT order
+    'fs': 1000,  # Sampling frequency in Hz
+    'fsr': 2.0,  # Full-scale range
+    'fund_freq': 1.0,  # Hz
+    'phase': 0.0,  # Tone phase
+    'td': 0.0,
+    'tj': 0.0,
+    'qres': 16,  # Quantizer resolution
+    'qnoise_dbfs': -140.0,  # Quantizer noise
+    'window': 'no_window',  # gn.Window member, lower case
+    'harm_dbfs': [-3.0, -23.0, -200.0, -200.0],
+    'noise_freqs': [1.5, 2.5, 3.5, 4.5],
+    'noise_dbfs': [-200.0, -23.0, -200.0, -200.0],
+    'backend': 'auto',  # see genalyzer_functions.import_genalyzer
+    'streaming': False,  # one nfft segment at a time, see genalyzer_functions.streaming_rfft
+}
+
+RESULT_FIELDS = ['freq', 'mag_dbfs', 'phase']
+
+
+def harmonic_label(harmonic):
+    # genalyzer names the fundamental A, then 2A, 3A, ...
+    return 'A' if harmonic == 1 else '{}A'.format(harmonic)
+
+
+def set_value(config, name, value):
+    # name is a key of DEFAULTS, or name[i] for one element of a list
+    if name.endswith(']'):
+        name, index = name[:-1].split('[')
+        config[name] = list(config[name])
+        config[name][int(index)] = value
+    elif name in DEFAULTS:
+        config[name] = value
+    else:
+        raise KeyError("Unknown sweep parameter {}".format(name))
+
+
+def expand_grid(axes, base=None):
+    # One configuration per combination of the axes, a dict of name -> list of values
+    # Returns (configs, points), points being the swept values of each configuration
+    base = dict(DEFAULTS, **(base or {}))
+    names = list(axes)
+    configs = []
+    points = []
+    for values in itertools.product(*(axes[name] for name in names)):
+        config = dict(base)
+        for name, value in zip(names, values):
+            set_value(config, name, value)
+        configs.append(config)
+        points.append(dict(zip(names, values)))
+    return configs, points
+
+
+def parse_value(text):
+    # Numbers and lists as Python literals, anything else as a string
+    try:
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return text
+
+
+# Fourier analysis configurations built in this process, one per distinct analysis setup
+_fa_keys = {}
+
+
+def _fa_key(gn, fund_freq, ssb_fund, ssb_rest, harmonics, fs):
+    setup = (gn.__name__, fund_freq, ssb_fund, ssb_rest, harmonics, fs)
+    key = _fa_keys.get(setup)
+    if key is None:
+        key = genalyzer_functions.configure_fa(gn, 'sweep_{}_{}_{}'.format(gn.__name__, os.getpid(), len(_fa_keys)),
+                                               fund_freq, fs, ssb_fund, ssb_rest, harmonics)
+        _fa_keys[setup] = key
+    return key
+
+
+def analyze(config):
+    # Runs one configuration, same steps as genalyze_signal.py, and returns a flat dict of results
+    gn = genalyzer_functions.import_genalyzer(config['backend'])
+
+    navg = config['navg']
+    nfft = config['nfft']
+    npts = navg * nfft
+    fs = config['fs']
+    fsr = config['fsr']
+    window = getattr(gn.Window, config['window'].upper())
+    code_fmt = gn.CodeFormat.TWOS_COMPLEMENT
+
+    fund_freq = config['fund_freq']
+    ssb_fund = 4
+    ssb_rest = 5
+    noise_freqs = list(config['noise_freqs'])
+    if gn.Window.NO_WINDOW == window:
+        fund_freq = gn.coherent(nfft, fs, fund_freq)
+        noise_freqs = [gn.coherent(nfft, fs, freq) for freq in noise_freqs]
+        ssb_fund = 0
+        ssb_rest = 0
+
+    harm_dbfs = config['harm_dbfs']
+    harm_ampl = genalyzer_functions.dbfs_to_ampl(harm_dbfs, fsr)
+    noise_ampl = genalyzer_functions.dbfs_to_ampl(config['noise_dbfs'], fsr)
+    tones = genalyzer_functions.tone_table([fund_freq * (h + 1) for h in range(len(harm_dbfs))] + noise_freqs,
+                                           list(harm_ampl) + list(noise_ampl), config['phase'])
+    qnoise = 10 ** (config['qnoise_dbfs'] / 20)
+    if config['streaming'] and config['td'] == 0.0 and config['tj'] == 0.0:
+        # One segment at a time, so many workers fit in memory even with deep averaging
+        fft_cplx = genalyzer_functions.streaming_rfft(tones, fs, nfft, navg, fsr, config['qres'], qnoise, window,
+                                                      code_fmt, gn.RfftScale.DBFS_SIN, gn=gn)
+    else:
+        awf = np.zeros(npts)
+        for tone in tones:
+            awf += gn.cos(npts, fs, tone.ampl, tone.freq, tone.phase, config['td'], config['tj'])
+        qwf = gn.quantize(awf, fsr, config['qres'], qnoise, code_fmt)
+        del awf
+        fft_cplx = gn.rfft(np.array(qwf), config['qres'], navg, nfft, window, code_fmt, gn.RfftScale.DBFS_SIN)
+
+    harmonics = max(len(harm_dbfs), 2)
+    key = _fa_key(gn, fund_freq, ssb_fund, ssb_rest, harmonics, fs)
+    fft_results = gn.fft_analysis(key, fft_cplx, nfft)
+
+    result = {
+        'snr': fft_results['snr'],
+        'fsnr': fft_results['fsnr'],
+        'thd': 20 * np.log10(fft_results['thd_rss'] / harm_ampl[0]),
+    }
+    for harmonic in range(1, harmonics + 1):
+        for field in RESULT_FIELDS:
+            name = '{}:{}'.format(harmonic_label(harmonic), field)
+            result[name] = fft_results.get(name, np.nan)
+    return result
+
+
+def to_columns(points, results):
+    # Lists of per-configuration dicts -> dict of equal length arrays
+    # A result missing from some rows is filled with NaN
+    columns = {}
+    for rows in (points, results):
+        names = []
+        for row in rows:
+            names += [name for name in row if name not in names]
+        for name in names:
+            values = [row.get(name, np.nan) for row in rows]
+            columns[name] = np.array(values)
+    return columns
+
+
+def run_sweep(configs, points=None, workers=None, chunksize=None):
+    # Analyzes every configuration in a pool of worker processes, workers defaults to the CPU count
+    # Returns the columnar table, see to_columns. points default to the index of each configuration.
+    if points is None:
+        points = [{'index': i} for i in range(len(configs))]
+    workers = workers or os.cpu_count() or 1
+    if chunksize is None:
+        # Several configurations per task keep the pool busy without paying a round trip for each
+        chunksize = max(1, len(configs) // (workers * 4))
+    if workers == 1:
+        results = [analyze(config) for config in configs]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(analyze, configs, chunksize=chunksize))
+    return to_columns(points, results)
+
+
+def save_table(path, columns, **metadata):
+    # Columns as arrays of an NPZ file, metadata as JSON in the _metadata entry
+    np.savez(path, _metadata=json.dumps(metadata), **columns)
+
+
+def load_table(path):
+    # Returns (columns, metadata)
+    with np.load(path) as data:
+        columns = {name: data[name] for name in data.files if name != '_metadata'}
+        metadata = json.loads(str(data['_metadata'])) if '_metadata' in data.files else {}
+    return columns, metadata
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel SNR/THD sweep of the genalyze_signal pipeline")
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help="change one setting for every point")
+    parser.add_argument('--grid', action='append', default=[], metavar='NAME=V1,V2,...',
+                        help="sweep a setting over these values, several --grid give their product")
+    parser.add_argument('--configs', help="JSON file with a list of settings dicts, instead of --grid")
+    parser.add_argument('--workers', type=int, help="worker processes (default: all CPUs)")
+    parser.add_argument('--output', default='sweep.npz', help="NPZ file for the results table")
+    args = parser.parse_args(argv)
+
+    base = dict(DEFAULTS)
+    for item in args.set:
+        name, value = item.split('=', 1)
+        set_value(base, name, parse_value(value))
+
+    if args.configs:
+        with open(args.configs) as f:
+            points = json.load(f)
+        configs = []
+        for point in points:
+            config = dict(base)
+            for name, value in point.items():
+                set_value(config, name, value)
+            configs.append(config)
+    else:
+        axes = {}
+        for item in args.grid:
+            name, values = item.split('=', 1)
+            axes[name] = [parse_value(value) for value in values.split(',')]
+        configs, points = expand_grid(axes, base)
+
+    start = time.monotonic()
+    columns = run_sweep(configs, points, args.workers)
+    elapsed = time.monotonic() - start
+    save_table(args.output, columns, base=base, elapsed_s=elapsed)
+    print("{} configurations in {:.1f} s, saved to {}".format(len(configs), elapsed, args.output), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pytest
+
+# Regression tests of the colorimeter engine on SimulatedBackend, no hardware needed
+#
+#   python -m pytest tests
+#
+# The simulated LED is a square wave, so odd harmonics alias onto the other LED tones at 10 kSa/s
+# (the 15th harmonic of 700 Hz lands on 500 Hz): red reads about 83.5% for an attenuation of 0.8.
+# Absolute readings are therefore checked loosely, the different code paths against each other tightly.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'colorimeter'))
+
+import colorimeter_calibration  # noqa: E402
+import colorimeter_capture  # noqa: E402
+import colorimeter_cli  # noqa: E402
+import colorimeter_functions  # noqa: E402
+from colorimeter_backends import ReplayBackend, SimulatedBackend  # noqa: E402
+from colorimeter_engine import Colorimeter  # noqa: E402
+from colorimeter_lockin import LockInDemodulator  # noqa: E402
+from colorimeter_pipeline import ColorimeterPipeline  # noqa: E402
+
+ATTENUATION = (0.8, 0.5, 0.3)
+
+
+def make_colorimeter(seed=1, **kwargs):
+    backend = SimulatedBackend(attenuation=ATTENUATION, realtime=False, seed=seed)
+    return Colorimeter(backend, **kwargs).start()
+
+
+def test_measure_reads_attenuation():
+    colorimeter = make_colorimeter()
+    raw = np.mean([colorimeter.measure(colorimeter.acquire()).raw for i in range(8)], axis=0)
+    # Red also picks up the aliased harmonics of the other tones
+    np.testing.assert_allclose(raw, np.array(ATTENUATION) * 100, atol=5.0)
+    np.testing.assert_allclose(raw[1:], np.array(ATTENUATION[1:]) * 100, atol=1.0)
+
+
+def test_measure_without_spectrum_matches_full_fft():
+    for bins in (None, ([83], [98], [115])):
+        colorimeter = make_colorimeter(bins=bins)
+        frame = colorimeter.acquire()
+        full = colorimeter.measure(frame)
+        sparse = colorimeter.measure(frame, spectrum=False)
+        assert sparse.ref_spectrum is None and sparse.sample_spectrum is None
+        np.testing.assert_allclose(sparse.raw, full.raw, rtol=1e-9)
+        np.testing.assert_allclose(sparse.sample_power, full.sample_power, rtol=1e-9)
+
+
+def test_rgb_pattern_plan_is_exact():
+    plan = colorimeter_functions.optimize_pg_sample_rate(colorimeter_functions.led_freqs)
+    assert plan == colorimeter_functions.plan_buffer(10000, colorimeter_functions.led_freqs)
+    assert plan.samples == 1600 and plan.periods == (80, 96, 112)
+    assert plan.phase_errors == (0.0, 0.0, 0.0) and plan.freq_errors == (0.0, 0.0, 0.0)
+    assert colorimeter_functions.plan_period(10000, 600) == (50, 3, 0.0)
+
+
+def test_plan_period_approximates_irrational_ratios():
+    plan = colorimeter_functions.plan_period(10000, 733.37)
+    assert plan.samples <= colorimeter_functions.max_buffer_size
+    assert 0.0 < plan.error < 1.0
+    assert abs(10000 * plan.periods / plan.samples - 733.37) < 1e-6
+    assert colorimeter_functions.plan_period(10000, 3, max_size=100) is None
+
+
+def test_start_rejects_tones_without_a_buffer():
+    backend = SimulatedBackend(realtime=False)
+    colorimeter = Colorimeter(backend, led_tones=[(499.9, 13), (600.1, 14), (733.37, 15)])
+    with pytest.raises(ValueError, match="499.9"):
+        colorimeter.start()
+
+
+def test_calibration_brings_readings_to_100(tmp_path):
+    colorimeter = make_colorimeter()
+    store = colorimeter_calibration.CalibrationStore(str(tmp_path / 'calibration.json'))
+    factors = colorimeter.calibrate_frames(8, store)
+    transmittance = np.mean([colorimeter.measure(colorimeter.acquire()).transmittance for i in range(8)], axis=0)
+    np.testing.assert_allclose(transmittance, 100.0, atol=1.0)
+
+    other = make_colorimeter(seed=2)
+    assert other.load_calibration(store)
+    np.testing.assert_allclose(other.calibration, factors)
+
+
+def test_corrupt_calibration_store_is_ignored(tmp_path):
+    path = tmp_path / 'calibration.json'
+    path.write_text('{"a": 1} garbage')
+    store = colorimeter_calibration.CalibrationStore(str(path))
+    colorimeter = make_colorimeter()
+    assert not colorimeter.load_calibration(store)
+    colorimeter.calibrate_frames(2, store)
+    assert colorimeter.load_calibration(store)
+    json.loads(path.read_text())
+
+
+def test_replay_never_saves_calibration(tmp_path):
+    path = str(tmp_path / 'run.cap')
+    store = colorimeter_calibration.CalibrationStore(str(tmp_path / 'calibration.json'))
+    colorimeter = make_colorimeter()
+    factors = colorimeter.calibrate_frames(4, store)
+    colorimeter.record(path)
+    for i in range(4):
+        colorimeter.acquire()
+    colorimeter.close()
+
+    replayed = Colorimeter(ReplayBackend(path), min_samples=colorimeter.samples)
+    assert replayed.load_calibration(store)
+    replayed.calibrate_frames(4, store)
+    np.testing.assert_allclose(store.load(replayed.backend.device_id, replayed.led_freqs), factors)
+
+
+def test_pipeline_delivers_measurements():
+    colorimeter = make_colorimeter()
+    with ColorimeterPipeline(colorimeter.acquire, colorimeter.measure) as pipeline:
+        deadline = time.monotonic() + 10.0
+        measurement = None
+        while measurement is None and time.monotonic() < deadline:
+            measurement = pipeline.latest()
+            time.sleep(0.01)
+    assert measurement is not None
+    np.testing.assert_allclose(measurement.raw[1:], np.array(ATTENUATION[1:]) * 100, atol=1.0)
+    stats = pipeline.stats()
+    assert stats['frames_processed'] >= 1
+    assert stats['frames_acquired'] >= stats['frames_processed']
+
+
+def test_capture_round_trip(tmp_path):
+    path = str(tmp_path / 'run.cap')
+    colorimeter = make_colorimeter()
+    colorimeter.record(path)
+    frames = [np.array(colorimeter.acquire()) for i in range(5)]
+    raw = [colorimeter.measure(frame).raw for frame in frames]
+    colorimeter.close()
+
+    replay = ReplayBackend(path)
+    assert replay.contiguous
+    replayed = Colorimeter(replay, min_samples=len(frames[0][0]))
+    for frame in frames:
+        np.testing.assert_array_equal(replayed.acquire(), frame)
+    with pytest.raises(EOFError):
+        replayed.acquire()
+
+    np.testing.assert_allclose(colorimeter_capture.replay_transmittance(path, batch=2, calibrate=False), raw,
+                               rtol=1e-9)
+
+
+def test_cli_replays_capture_with_explicit_bins(tmp_path):
+    path = str(tmp_path / 'blackman.cap')
+    bins = ([204, 205], [245, 246], [286, 287])
+    colorimeter = make_colorimeter(bins=bins)
+    colorimeter.record(path)
+    raw = [colorimeter.measure(colorimeter.acquire()).raw for i in range(3)]
+    colorimeter.close()
+
+    # 4096 sample frames are not coherent at 10 kSa/s, the bins must be given
+    with pytest.raises(SystemExit, match='--bins'):
+        colorimeter_cli.main(['--backend', 'replay', '--input', path, '--fast'])
+    output = str(tmp_path / 'replay.jsonl')
+    colorimeter_cli.main(['--backend', 'replay', '--input', path, '--fast', '--bins', json.dumps(bins),
+                          '--format', 'jsonl', '--output', output])
+    with open(output) as stream:
+        rows = [json.loads(line) for line in stream]
+    np.testing.assert_allclose([[row['red'], row['green'], row['blue']] for row in rows], raw, rtol=1e-9)
+
+
+def test_capture_with_more_rows(tmp_path):
+    class FourRows(SimulatedBackend):
+        rows = 4
+
+        def acquire(self, samples):
+            frame = super().acquire(samples)
+            return np.vstack([frame, frame[1:] * 0.5, frame[1:] * 0.25])
+
+    path = str(tmp_path / 'rows.cap')
+    colorimeter = Colorimeter(FourRows(realtime=False, seed=3)).start()
+    colorimeter.record(path)
+    frames = [colorimeter.acquire() for i in range(3)]
+    colorimeter.close()
+    expected = [colorimeter.measure_channels(frame) for frame in frames]
+    result = colorimeter_capture.replay_transmittance(path, calibrate=False)
+    assert result.shape == (3, 3, 3)
+    np.testing.assert_allclose(result, expected, rtol=1e-9)
+
+
+def test_live_plot_draws_deferred_data():
+    matplotlib = pytest.importorskip('matplotlib')
+    matplotlib.use('Agg')
+    from colorimeter_plot import LivePlot
+    plot = LivePlot(2048, fft_ylim=1.0, max_fps=10)
+    spectrum = np.zeros(2048)
+    assert plot.update(spectrum, spectrum, [10, 20, 30])
+    # Within 1 / max_fps of the last draw: kept, then drawn by wait() once the interval has passed
+    assert not plot.update(spectrum, spectrum, [40, 50, 60])
+    plot.wait(0.15)
+    assert [bar.get_height() for bar in plot.bars] == [40, 50, 60]
+
+
+def test_averager_matches_one_long_frame():
+    colorimeter = make_colorimeter()
+    measurements = [colorimeter.measure(colorimeter.acquire()) for i in range(10)]
+    averager = colorimeter_functions.TransmittanceAverager(3, 'cumulative')
+    for measurement in measurements:
+        average = averager.update_powers(measurement.sample_power, measurement.ref_power)
+    sample_power = np.sum([m.sample_power for m in measurements], axis=0)
+    ref_power = np.sum([m.ref_power for m in measurements], axis=0)
+    np.testing.assert_allclose(average, np.sqrt(sample_power / ref_power) * 100)
+    low, high = averager.confidence_interval()
+    assert np.all(low <= average) and np.all(average <= high)
+
+    sliding = colorimeter_functions.TransmittanceAverager(3, 'sliding', window=4)
+    for measurement in measurements:
+        average = sliding.update_powers(measurement.sample_power, measurement.ref_power)
+    sample_power = np.sum([m.sample_power for m in measurements[-4:]], axis=0)
+    ref_power = np.sum([m.ref_power for m in measurements[-4:]], axis=0)
+    np.testing.assert_allclose(average, np.sqrt(sample_power / ref_power) * 100)
+
+
+def test_lockin_matches_fft_and_any_chunking():
+    colorimeter = make_colorimeter()
+    demodulator = colorimeter.lockin(output_rate=100)
+    data = np.hstack([colorimeter.acquire() for i in range(6)])
+    windows = data.shape[1] // demodulator.decimation
+
+    whole = LockInDemodulator(colorimeter.backend.sample_rate, colorimeter.led_freqs, 100).process(data)
+    assert whole.shape == (windows, 2, 3)
+    # Each window is one coherent frame: same band powers as the FFT path on those samples
+    table = colorimeter_functions.bin_table(colorimeter_functions.plan_acquisition(
+        colorimeter.backend.sample_rate, colorimeter.led_freqs, demodulator.decimation).bins)
+    for index in range(windows):
+        frame = data[:, index * demodulator.decimation:(index + 1) * demodulator.decimation]
+        expected = colorimeter_functions.band_power_matrix(colorimeter.spectrum.compute(frame), table)
+        np.testing.assert_allclose(whole[index], expected, rtol=1e-9)
+
+    chunked = LockInDemodulator(colorimeter.backend.sample_rate, colorimeter.led_freqs, 100)
+    pieces = [chunked.process(piece) for piece in np.array_split(data, [37, 38, 250, 251, 400], axis=1)]
+    np.testing.assert_allclose(np.concatenate(pieces), whole, rtol=1e-9)
+
+
+def test_lockin_rejects_partial_windows_on_separate_captures():
+    class Separate(SimulatedBackend):
+        contiguous = False
+
+    colorimeter = Colorimeter(Separate(realtime=False)).start()
+    decimation = colorimeter.lockin(output_rate=100).decimation
+    assert colorimeter.lockin(output_rate=100, chunk=3 * decimation).decimation == decimation
+    with pytest.raises(ValueError):
+        colorimeter.lockin(output_rate=100, chunk=decimation + 1)
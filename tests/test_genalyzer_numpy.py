@@ -0,0 +1,38 @@
+import os
+import sys
+
+import numpy as np
+
+# Checks of the NumPy genalyzer backend on signals with known results, no genalyzer_advanced needed
+#
+#   python -m pytest tests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'genalyzer'))
+
+import genalyzer_functions  # noqa: E402
+import genalyzer_numpy as gn  # noqa: E402
+
+
+def test_two_tone_analysis():
+    # Fundamental at -3 dBFS and its 2nd harmonic at -23 dBFS, coherent, no window, ideal 16 bit quantizer
+    nfft, fs, qres = 1024 * 16, 1000.0, 16
+    fund_freq = gn.coherent(nfft, fs, 10.0)
+    tones = genalyzer_functions.tone_table([fund_freq, 2 * fund_freq], genalyzer_functions.dbfs_to_ampl(
+        [-3.0, -23.0], 2.0))
+    awf = genalyzer_functions.multitone(nfft, fs, tones)
+    codes = gn.quantize(awf, 2.0, qres, 0.0, gn.CodeFormat.TWOS_COMPLEMENT)
+    fft_cplx = gn.rfft(codes, qres, 1, nfft, gn.Window.NO_WINDOW, gn.CodeFormat.TWOS_COMPLEMENT,
+                       gn.RfftScale.DBFS_SIN)
+
+    key = genalyzer_functions.configure_fa(gn, 'test_two_tone', fund_freq, fs, 0, 0)
+    results = gn.fft_analysis(key, fft_cplx, nfft)
+    assert abs(results['A:mag_dbfs'] + 3.0) < 0.01
+    assert abs(results['2A:mag_dbfs'] + 23.0) < 0.01
+    np.testing.assert_allclose(results['thd_rss'], 10 ** (-23.0 / 20), rtol=1e-3)
+    # Quantization noise of an ideal converter: 6.02 * qres + 1.76 dB below a full-scale sine
+    assert abs(results['snr'] - (6.02 * qres + 1.76 - 3.0)) < 1.0
+    assert not any(key.startswith('_') for key in results)
+
+    labels = [name for freq, mag, name in gn.fa_annotations(results)['labels']]
+    assert labels[:3] == ['dc', 'A', '2A'] and labels[-1] == 'wo'